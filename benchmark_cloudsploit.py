@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+import argparse, concurrent.futures, contextlib, csv, importlib.util, io, itertools, json, multiprocessing, operator, os, pathlib, platform, random, sys, tempfile, time, xlsxwriter
+import format_cloudsploit
+try:
+    import resource     # Peak RSS; not available on Windows
+except ImportError:
+    resource = None
+
+# CloudSploit CLI and Aqua Wave CSV layouts (see format_cloudsploit.get_columns())
+HEADERS = {
+    'cli': ['category', 'title', 'description', 'resource', 'region', 'statusWord', 'message'],
+    'aquawave': ['category', 'title', 'description', 'region', 'status', 'resource', 'message']
+}
+REGIONS = ['global', 'us-east-1', 'us-east-2', 'us-west-2', 'eu-west-1', 'eu-central-1', 'ap-southeast-2']
+RESULTS = {'cli': ['OK', 'FAIL', 'WARN', 'UNKNOWN'], 'aquawave': ['PASS', 'FAIL', 'WARN', 'UNKNOWN']}
+MESSAGES = {    # Result messages in the style of the CloudSploit plugins; the commas and quotes get the csv module to quote them
+    'OK': ['No issues found', 'Encryption is enabled, using a customer managed key', 'Default encryption is enabled with "aws:kms"'],
+    'FAIL': ['Key rotation is not enabled', 'Security group "default" allows inbound traffic on port 22 from 0.0.0.0/0', 'Bucket has 3 objects without encryption, including "backup.tar.gz"'],
+    'WARN': ['Certificate expires in 25 days, on 2024-07-01', 'Log retention is set to 30 days, below the recommended 365'],
+    'UNKNOWN': ['Unable to query for resources: {"code":"AccessDeniedException","message":"User is not authorized, check the role policy"}'],
+}
+MESSAGES['PASS'] = MESSAGES['OK']
+STAGES = ['observations', 'statistics', 'raw', 'format_sheet']     # Measured one per worker process by run_stage()
+COMPARISONS = ['decoding', 'grouping', 'backends', 'formatting']                # Side by side comparisons of alternative implementations
+
+
+def generate_csv(filename, rows, tests = 200, fail_ratio = 0.4, order = 'shuffled', seed = 1, layout = 'cli', quoted = True):
+    # Deterministic synthetic CLI / Aqua Wave export; test titles, categories and descriptions come from the real plugin
+    # mappings, and messages (some of them quoted) from MESSAGES. Without `quoted`, descriptions and messages are plain
+    # text, so that no field of the export is quoted
+    rng = random.Random(seed)
+    plugins = format_cloudsploit.load_plugin_index()
+    titles = sorted(plugins)[:tests]
+    results = RESULTS[layout]
+    entries = []
+    for index in range(rows):
+        title = titles[index % len(titles)]
+        category, description = plugins[title][0], plugins[title][2]
+        result = 'FAIL' if rng.random() < fail_ratio else rng.choice(results)
+        resource = 'N/A' if rng.random() < 0.2 else f'arn:aws:service:{rng.choice(REGIONS)}:123456789012:resource/{rng.randrange(rows)}'
+        message = rng.choice(MESSAGES[result])
+        if not quoted:
+            description, message = 'Synthetic finding', 'Synthetic message'
+        if layout == 'cli':
+            entries.append([category, title, description, resource, rng.choice(REGIONS), result, message])
+        else:
+            entries.append([category, title, description, rng.choice(REGIONS), result, resource, message])
+    if order == 'shuffled':
+        rng.shuffle(entries)
+    else:
+        entries.sort(key=operator.itemgetter(1))
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(HEADERS[layout])
+        writer.writerows(entries)
+    return filename
+
+
+def null_sinks(presorted = False):
+    # Observation and statistics sinks that aggregate and emit rows without a workbook behind them
+    return [format_cloudsploit.ObservationsSink(format_cloudsploit.NullSheet(), [], {}, [{},{}], presorted),
+            format_cloudsploit.StatisticsSink(format_cloudsploit.NullSheet(), [], {}, presorted)]
+
+
+def group_hashed(filename):
+    # Current engine: one O(n) pass, grouping in a dict whatever the input order
+    sinks = null_sinks()
+    format_cloudsploit.stream_scan(filename, sinks, close=False)
+    for sink in sinks:
+        sink.flush()
+
+
+def group_sorted(filename):
+    # Alternative for unsorted input: sort a full copy of the (title, asset, region, result) rows by title, then group on
+    # title changes
+    sinks = null_sinks(presorted=True)
+    project = operator.itemgetter(*format_cloudsploit.get_columns())
+    with open(filename) as file:
+        lines = csv.reader(file)
+        next(lines)
+        entries = sorted(map(project, lines), key=operator.itemgetter(0))
+    for start in range(0, len(entries), format_cloudsploit.BATCH_ROWS):
+        columns = [list(column) for column in zip(*entries[start:start+format_cloudsploit.BATCH_ROWS])]
+        for sink in sinks:
+            sink.feed_columns(columns)
+    for sink in sinks:
+        sink.flush()
+
+
+def decode_rows(filename):
+    # Previous decoder: every column of every row through the csv module, then the SCAN_COLUMNS picked out of each row
+    project = operator.itemgetter(*format_cloudsploit.get_columns())
+    with open(filename) as file:
+        lines = csv.reader(file)
+        next(lines)
+        for batch in iter(lambda: list(itertools.islice(lines, format_cloudsploit.BATCH_ROWS)), []):
+            list(map(project, batch))
+
+
+def decode_columns(filename):
+    # Current decoder: header sniffed once, then only the SCAN_COLUMNS of each block split out (see read_columns())
+    with format_cloudsploit.open_scan(filename) as file, format_cloudsploit.paused_gc():
+        header = next(csv.reader([file.readline().decode(format_cloudsploit.SCAN_ENCODING)]))
+        columns, scan_type = format_cloudsploit.detect_columns(header, format_cloudsploit.peek_rows(file))
+        for batch in format_cloudsploit.read_columns(file, len(header), columns):
+            pass
+
+
+def generate_columns(rows, tests = 200, fail_ratio = 0.4, seed = 1):
+    # In-memory (titles, assets, regions, results) columns sharing their strings, for benchmarking aggregation without CSV parsing
+    rng = random.Random(seed)
+    titles = sorted(format_cloudsploit.load_plugin_index())[:tests]
+    results = ['FAIL' if rng.random() < fail_ratio else rng.choice(RESULTS['cli']) for index in range(len(RESULTS['cli'])*10)]
+    return [[rng.choice(titles) for index in range(rows)], ['N/A']*rows, ['global']*rows, [rng.choice(results) for index in range(rows)]]
+
+
+def count_statistics(sink, columns, repeat):
+    for index in range(repeat):
+        for start in range(0, len(columns[0]), format_cloudsploit.BATCH_ROWS):
+            sink.feed_columns([column[start:start+format_cloudsploit.BATCH_ROWS] for column in columns])
+    return sink.collect()
+
+
+def time_call(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def benchmark_decoding(sizes, tests):
+    # Plain exports (no quoted fields) and realistic ones (quoted descriptions and messages) are decoded separately
+    for quoted in [False, True]:
+        print(f'[+] Decoding shuffled {"quoted" if quoted else "plain"} CLI exports ({tests} distinct tests)')
+        print(f'{"Rows":>10} {"csv (s)":>12} {"Rows/s":>12} {"Columns (s)":>12} {"Rows/s":>12} {"Speedup":>8}')
+        with tempfile.TemporaryDirectory() as directory:
+            for rows in sizes:
+                filename = generate_csv(str(pathlib.Path(directory) / f'shuffled_{rows}.csv'), rows, tests, quoted = quoted)
+                reader = time_call(decode_rows, filename)
+                columns = time_call(decode_columns, filename)
+                print(f'{rows:>10} {reader:>12.3f} {rows/reader:>12.0f} {columns:>12.3f} {rows/columns:>12.0f} {reader/columns:>7.1f}x')
+
+
+def benchmark_grouping(sizes, tests):
+    print(f'[+] Grouping shuffled CLI exports ({tests} distinct tests)')
+    print(f'{"Rows":>10} {"Hashed (s)":>12} {"Rows/s":>12} {"Sorted (s)":>12} {"Rows/s":>12}')
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in sizes:
+            filename = generate_csv(str(pathlib.Path(directory) / f'shuffled_{rows}.csv'), rows, tests)
+            hashed = time_call(group_hashed, filename)
+            ordered = time_call(group_sorted, filename)
+            print(f'{rows:>10} {hashed:>12.3f} {rows/hashed:>12.0f} {ordered:>12.3f} {rows/ordered:>12.0f}')
+
+
+def benchmark_statistics(sizes, tests, chunk = 1000000):
+    # Pass-fail counting only: rows are generated once (at most `chunk` of them) and replayed to reach each size
+    backend = 'numpy' if importlib.util.find_spec('numpy') else 'array/Counter'
+    print(f'[+] Counting pass / fail results ({tests} distinct tests, columnar backend using {backend})')
+    print(f'{"Rows":>10} {"Loop (s)":>12} {"Rows/s":>12} {"Columnar (s)":>12} {"Rows/s":>12}')
+    columns = generate_columns(min(chunk, max(sizes)), tests)
+    for rows in sizes:
+        sample, repeat = [column[:rows] for column in columns], max(1, rows // len(columns[0]))
+        loop_sink = format_cloudsploit.StatisticsSink(format_cloudsploit.NullSheet(), [], {})
+        columnar_sink = format_cloudsploit.ColumnarStatisticsSink(format_cloudsploit.NullSheet(), [], {})
+        loop = time_call(count_statistics, loop_sink, sample, repeat)
+        columnar = time_call(count_statistics, columnar_sink, sample, repeat)
+        if loop_sink.groups != columnar_sink.groups:
+            print('[x] Columnar counts do not match the loop backend!')
+        counted = len(sample[0])*repeat
+        print(f'{counted:>10} {loop:>12.3f} {counted/loop:>12.0f} {columnar:>12.3f} {counted/columnar:>12.0f}')
+
+
+def build_workbook(filename, targets, static_formats):
+    # Observation + statistics sheets for every target, as format_cloudsploit.py -d ... --include-statistics would write them
+    workbook = xlsxwriter.Workbook(filename)
+    formats = format_cloudsploit.StaticStyles(workbook) if static_formats else format_cloudsploit.add_formats(workbook)
+    with contextlib.redirect_stdout(io.StringIO()):
+        format_cloudsploit.format_targets_grouped(workbook, targets, format_cloudsploit.SUPPORTED_COMPLIANCE_STANDARDS[1:], formats, True)
+    workbook.close()
+
+
+def benchmark_formatting(sizes, tests, sheets = 40):
+    # Conditional formatting rules per sheet (format_sheet()) against precomputed static cell formats (StaticStyles)
+    print(f'[+] Formatting {sheets} observation + statistics sheet pairs ({tests} distinct tests)')
+    print(f'{"Rows/sheet":>10} {"Conditional (s)":>16} {"Size (KB)":>10} {"Static (s)":>11} {"Size (KB)":>10}')
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in sizes:
+            targets = [generate_csv(str(pathlib.Path(directory) / f'scan_{rows}_{index}.csv'), rows, tests, seed=index) for index in range(sheets)]
+            results = []
+            for static_formats in (False, True):
+                output = str(pathlib.Path(directory) / f'formatting_{rows}_{static_formats}.xlsx')
+                results += [time_call(build_workbook, output, targets, static_formats), os.path.getsize(output)/1024]
+            print(f'{rows:>10} {results[0]:>16.3f} {results[1]:>10.0f} {results[2]:>11.3f} {results[3]:>10.0f}')
+
+
+def peak_rss():
+    # Peak resident set size of this process in KB (ru_maxrss is in bytes on macOS)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_stage(stage, filename, rows, layout, output):
+    # Time one stage writing its own workbook; runs in a fresh (spawned) process so the peak RSS belongs to this stage alone
+    options = format_cloudsploit.ScanOptions(layout)
+    standards = format_cloudsploit.SUPPORTED_COMPLIANCE_STANDARDS[1:]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        workbook = xlsxwriter.Workbook(output)
+        formats = format_cloudsploit.add_formats(workbook)
+        if stage == 'observations':
+            format_cloudsploit.format_observations(workbook, filename, 'Observations', standards, formats, scan_type=layout)
+        elif stage == 'statistics':
+            format_cloudsploit.format_statistics(workbook, filename, 'Pass-Fail Rates', standards, formats, options)
+        elif stage == 'raw':
+            format_cloudsploit.copy_raw_output(workbook, filename)
+        else:   # format_sheet: a table of `rows` observations written and formatted without parsing a CSV first
+            worksheet = workbook.add_worksheet('Observations')
+            titles = sorted(format_cloudsploit.load_plugin_index())
+            for row in range(1, rows+1):
+                format_cloudsploit.append_row(worksheet, row, formats, titles[row % len(titles)], 'us-east-1', standards, [{},{}])
+            format_cloudsploit.format_sheet(worksheet, rows+1, formats, chr(ord('H') + len(standards)))
+        workbook.close()
+    return time.perf_counter() - start, peak_rss(), os.path.getsize(output)
+
+
+def benchmark_stages(sizes, tests, fail_ratio, order, layout, stages):
+    print(f'[+] Benchmarking stages on {order} {layout} exports ({tests} distinct tests, {fail_ratio:.0%} failing)')
+    print(f'{"Stage":>14} {"Rows":>10} {"Seconds":>10} {"Rows/s":>12} {"Peak RSS (MB)":>14} {"Output (KB)":>12}')
+    results = {}
+    context = multiprocessing.get_context('spawn')  # Forked workers would inherit (and count) the parent's memory
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in sizes:
+            filename = generate_csv(str(pathlib.Path(directory) / f'{layout}_{rows}.csv'), rows, tests, fail_ratio, order, layout=layout)
+            for stage in stages:
+                output = str(pathlib.Path(directory) / f'{stage}_{rows}.xlsx')
+                with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    seconds, rss, size = executor.submit(run_stage, stage, filename, rows, layout, output).result()
+                results.setdefault(stage, {})[str(rows)] = {'seconds': seconds, 'rows_per_second': rows / seconds, 'peak_rss_kb': rss, 'output_bytes': size}
+                rss_text = f'{rss/1024:.1f}' if rss is not None else 'n/a'
+                print(f'{stage:>14} {rows:>10} {seconds:>10.3f} {rows/seconds:>12.0f} {rss_text:>14} {size/1024:>12.0f}')
+    return results
+
+
+def save_baseline(filename, settings, results):
+    with open(filename, 'w') as file:
+        json.dump({'settings': settings, 'python': platform.python_version(), 'results': results}, file, indent=2)
+    print(f'[=] Saved baseline to \'{filename}\'')
+    return True
+
+
+def compare_baseline(filename, settings, results, tolerance):
+    # Flag every stage / size that got slower (or used more memory) than the baseline by more than `tolerance`
+    with open(filename) as file:
+        baseline = json.load(file)
+    if baseline.get('settings') != settings:
+        print(f'[!] Baseline \'{filename}\' was recorded with different settings: {baseline.get("settings")}')
+    regressions = 0
+    print(f'[+] Comparing against baseline \'{filename}\' (tolerance {tolerance:.0%})')
+    for stage, sizes in results.items():
+        for rows, current in sizes.items():
+            previous = baseline.get('results', {}).get(stage, {}).get(rows)
+            if previous is None:
+                continue
+            for metric in ('seconds', 'peak_rss_kb', 'output_bytes'):
+                if not previous.get(metric) or current[metric] is None:
+                    continue
+                change = current[metric] / previous[metric] - 1
+                if change > tolerance:
+                    regressions += 1
+                    print(f'[x] {stage} ({rows} rows): {metric} regressed {change:+.1%} ({previous[metric]:.6g} -> {current[metric]:.6g})')
+    print(f'[=] {regressions} regression(s) found' if regressions else '[=] No regressions found')
+    return regressions == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('python3 benchmark_cloudsploit.py --rows 10000 100000 1000000 --save-baseline baseline.json')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000], help='Synthetic CSV sizes to benchmark (default: 10000 100000 1000000)')
+    parser.add_argument('--stage', choices=STAGES+COMPARISONS, nargs='+', default=STAGES, help=f'Benchmarks to run (default: {" ".join(STAGES)})')
+    parser.add_argument('--tests', type=int, default=200, help='Number of distinct test titles (default: 200)')
+    parser.add_argument('--fail-ratio', type=float, default=0.4, help='Share of results that fail (default: 0.4)')
+    parser.add_argument('--order', choices=['shuffled', 'sorted'], default='shuffled', help='Row order of the synthetic CSVs (default: shuffled)')
+    parser.add_argument('--layout', choices=format_cloudsploit.SCAN_TYPES, default='cli', help='CSV layout of the synthetic scans (default: cli)')
+    parser.add_argument('--save-baseline', help='Write the stage results to this JSON file', default=None, required=False)
+    parser.add_argument('--compare', help='Compare the stage results against a JSON baseline; exits with status 1 on regressions', default=None, required=False)
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown / growth against the baseline before it counts as a regression (default: 0.2)')
+    args = parser.parse_args()
+
+    stages = [stage for stage in STAGES if stage in args.stage]
+    settings = {'rows': args.rows, 'tests': args.tests, 'fail_ratio': args.fail_ratio, 'order': args.order, 'layout': args.layout}
+    results = benchmark_stages(args.rows, args.tests, args.fail_ratio, args.order, args.layout, stages) if stages else {}
+    if 'decoding' in args.stage:
+        benchmark_decoding(args.rows, args.tests)
+    if 'grouping' in args.stage:
+        benchmark_grouping(args.rows, args.tests)
+    if 'backends' in args.stage:
+        benchmark_statistics(args.rows, args.tests)
+    if 'formatting' in args.stage:
+        benchmark_formatting(args.rows, args.tests)
+    if args.save_baseline:
+        save_baseline(args.save_baseline, settings, results)
+    if args.compare and not compare_baseline(args.compare, settings, results, args.tolerance):
+        exit(1)
@@ -1,47 +1,208 @@
 #!/usr/bin/env python3
 
-import argparse, csv, json, pathlib, sys, xlsxwriter, zipfile
+import argparse, array, collections, concurrent.futures, contextlib, cProfile, csv, gc, gzip, hashlib, io, itertools, json, operator, os, pathlib, pickle, shutil, signal, sys, tempfile, threading, time, tracemalloc, zipfile
+try:
+    import xlsxwriter   # Optional when only writing --format jsonl / sqlite
+except ImportError:
+    xlsxwriter = None
+try:
+    import inotify_simple   # Optional; --watch polls the directory without it
+except ImportError:
+    inotify_simple = None
+asyncio = None              # Only imported for --watch (see load_asyncio())
 
-# Prepare global constants / variables
-CHART_DATA = [{},{}] # Observation Areas (index 0), Risk Levels (index 1)
+# Prepare global constants; per-run state (scan type, chart data, ...) is passed around explicitly so runs can share a process
 SLASH = '\\' if sys.platform == 'win32' else '/'
 SUPPORTED_COMPLIANCE_STANDARDS = ['ALL', 'CMMC', 'CCPA', 'CIS Benchmarks', 'FedRamp', 'GDPR', 'HIPPA', 'ISO 27001', 'ISO 27017', 'ISO 27018', 'NIST 800-53', 'NIST 800-171', 'NIST CSF', 'PCI', 'SOC 2 Type II', 'SOC 3', 'Well Architected Framework']
-SCAN_TYPE = 'cli'
-MAPPINGS = {}
-with open('./static/plugin_mappings.json') as file:
-    MAPPINGS = json.load(file)
-
-
-def append_row(domains, titles, risks, descriptions, efforts, assets, test_title, test_assets, compliance_standards):
-    # Lookup CloudSploit plugin information from test title; Remove [DEFAULT] flag if it is present
-    plugin_mappings = MAPPINGS.get(test_title, {})
-    domain = plugin_mappings.get('PluginDomain', 'Unknown').replace('[DEFAULT]', 'Unknown')
-    severity = plugin_mappings.get('PluginSeverity', 'Unknown').replace('[DEFAULT] ', '').capitalize()
-    description = plugin_mappings.get('PluginTestDescription', 'Unknown').replace('[DEFAULT] ', '')
-    remediation = plugin_mappings.get('PluginRecommendation', 'Unknown').replace('[DEFAULT] ', '')
-
-    # Append values to the corresponding lists; empty current test assets afterwards
-    domains.append(domain)
-    titles.append(test_title)
-    risks.append(severity.capitalize())
-    descriptions.append(description)
-    efforts.append(remediation)  # efforts.append(effort)
-    assets.append('\n'.join(test_assets))
-    
-    # Update compliance standards (Columns H+)
-    for standard in compliance_standards.keys():
-        mappings = plugin_mappings.get('PluginComplianceMappings', {}).get(standard, [])
-        compliance_standards[standard].append('\n'.join(mappings))
+SCAN_TYPES = ['cli', 'aquawave']
+SCAN_LABELS = {'cli': 'CLI', 'aquawave': 'Aqua Wave'}
+BATCH_ROWS = 65536                                      # Rows handed to the sinks at a time by stream_scan()
+READ_CHUNK = 8*1024*1024                                # Bytes read and decoded at a time by read_columns()
+QUOTED_STAND_INS = ('\x1f', '\x1e')                     # Stand in for commas / newlines inside quoted fields (see split_records())
+SCAN_ENCODING = 'utf-8'                                 # Scans are read as bytes (see open_scan()) and decoded as such
+SCAN_COLUMNS = {'title': ['title'], 'resource': ['resource', 'asset'], 'region': ['region'], 'status': ['statusword', 'status', 'result']}   # Header names (lower case) of the columns the sinks read, in projected order
+SCAN_RESULTS = {'cli': ['OK', 'FAIL', 'WARN', 'UNKNOWN'], 'aquawave': ['PASS', 'FAIL', 'WARN', 'UNKNOWN']}   # Passing result first
+STATISTICS_BACKENDS = ['loop', 'columnar']              # StatisticsSink or ColumnarStatisticsSink (see new_statistics_sink())
+MAPPINGS_FILE = pathlib.Path(__file__).resolve().parent / 'static' / 'plugin_mappings.json'
+MAPPINGS_INDEX = MAPPINGS_FILE.with_suffix('.pickle')    # Compiled, normalized copy of MAPPINGS_FILE (see load_plugin_index())
+MAPPINGS_INDEX_VERSION = 2
+PLUGIN_INDEX = None                                     # Test title -> (domain, severity, description, remediation, {standard: joined mappings})
+CONTROL_INDEX = None                                    # Standard -> control -> test titles mapped to it (inverse of the above)
+PLUGIN_INDEX_LOCK = threading.Lock()                    # PLUGIN_INDEX is loaded once, then only ever read
+UNKNOWN_PLUGIN = ('Unknown', 'Unknown', 'Unknown', 'Unknown', {})
+# Workbook formats (see add_formats()); the risk, border, unknown, row and cell border formats are applied by format_sheet()
+FORMAT_PROPERTIES = {
+    'Row': {'bg_color': '#C0C0C0'},                                             # Light Grey (Overall Table Rows)
+    'Border': {'bg_color': '#404040', 'bold': 1, 'font_color': 'white'},        # Dark Grey (Overall Table Borders)
+    'Unknown': {'bg_color': '#FF0066'},                                         # Salmon (Unknown Observation Areas)
+    'Critical': {'bg_color': '#880000'},                                        # Dark Red (Critical Risk)
+    'High': {'bg_color': '#AA5500'},                                            # Orange (High Risk)
+    'Moderate': {'bg_color': '#FFFF66'},                                        # Yellow (Moderate Risk)
+    'Low': {'bg_color': '#009900'},                                             # Green (Low Risk)
+    'Info': {'bg_color': '#0099AA'},                                            # Blue (Informational)
+    'Assets': {'font_size': 9, 'text_wrap': True, 'align': 'left', 'valign': 'top'},   # Small Text (Affected Assets)
+    'Text': {'text_wrap': True, 'align': 'left', 'valign': 'top'},             # Regular Text (Interior Rows)
+    'CellBorders': {'border': 1},                                               # Add Cell Borders
+    'Center': {'align': 'center', 'valign': 'vcenter'}                          # Centered Text
+}
+RISK_LEVEL_FORMATS = {'critical': 'Critical', 'high': 'High', 'moderate': 'Moderate', 'medium': 'Moderate', 'low': 'Low', 'info': 'Info'}
+# Formats (see add_formats()) for table Columns B-G; the observation header row leaves 'Affected Assets' unformatted
+OBSERVATION_FORMATS = ['Text', 'Text', 'Center', 'Text', 'Text', 'Assets']
+STATISTICS_FORMATS = ['Text', 'Text', 'Center', 'Text', 'Text', 'Text']
+ASSET_CELL_LENGTH = 32767 - 100                         # Excel's cell length limit, less room for the '... more' line
+WATCH_QUEUE_SIZE = 256                                  # Scans --watch queues for parsing before it stops taking more
+WATCH_RENDER_INTERVAL = 10                              # Longest --watch waits for parsing to settle before re-rendering anyway
+SEVERITY_RANKS = {'critical': 0, 'high': 1, 'moderate': 2, 'medium': 2, 'low': 3, 'info': 4}   # Worst first; anything else ranks last
+# Formats for the compliance control pivot tabs (see CompliancePivot), Columns B-F
+PIVOT_FORMATS = ['Text', 'Assets', 'Center', 'Center', 'Center']
+RESERVED_SHEETS = ['Observation Categories', 'Risk Levels', 'ChartData']     # Fixed tabs of every report workbook, added without SheetNames
+EXCEL_MAX_ROWS = 1048576
+OUTPUT_FORMATS = {'xlsx': '.xlsx', 'jsonl': '.jsonl', 'sqlite': '.sqlite'}   # --format -> default output file suffix
+SQLITE_TABLES = [
+    'CREATE TABLE reports (id INTEGER PRIMARY KEY, name TEXT, scan_type TEXT)',
+    'CREATE TABLE targets (report_id INTEGER, path TEXT)',
+    'CREATE TABLE observations (id INTEGER PRIMARY KEY, report_id INTEGER, domain TEXT, title TEXT, severity TEXT, description TEXT, remediation TEXT, asset_count INTEGER, fail_count INTEGER)',
+    'CREATE TABLE assets (observation_id INTEGER, asset TEXT, count INTEGER)',
+    'CREATE TABLE statistics (report_id INTEGER, domain TEXT, title TEXT, severity TEXT, passes INTEGER, fails INTEGER, total INTEGER, pass_rate REAL)',
+    'CREATE TABLE compliance (title TEXT, standard TEXT, control TEXT, PRIMARY KEY (title, standard, control)) WITHOUT ROWID'
+]
+SQLITE_INDEXES = [     # Created once every row is in, which is cheaper than keeping them up to date during the bulk inserts
+    'CREATE INDEX observations_report ON observations (report_id, severity)',
+    'CREATE INDEX observations_title ON observations (title)',
+    'CREATE INDEX assets_observation ON assets (observation_id)',
+    'CREATE INDEX assets_asset ON assets (asset)',
+    'CREATE INDEX statistics_report ON statistics (report_id, title)',
+    'CREATE INDEX compliance_control ON compliance (standard, control)',
+    'CREATE INDEX targets_report ON targets (report_id)'
+]
+
+
+def compile_mappings(mappings):
+    # Normalize every plugin once: strip [DEFAULT] flags, canonicalize severities and pre-join each compliance cell
+    index = {}
+    for test_title, plugin_mappings in mappings.items():
+        domain = plugin_mappings.get('PluginDomain', 'Unknown').replace('[DEFAULT]', 'Unknown')
+        severity = plugin_mappings.get('PluginSeverity', 'Unknown').replace('[DEFAULT] ', '').capitalize()
+        description = plugin_mappings.get('PluginTestDescription', 'Unknown').replace('[DEFAULT] ', '')
+        remediation = plugin_mappings.get('PluginRecommendation', 'Unknown').replace('[DEFAULT] ', '')
+        compliance = {standard: '\n'.join(controls) for standard, controls in plugin_mappings.get('PluginComplianceMappings', {}).items()}
+        index[test_title] = (domain, severity, description, remediation, compliance)
+    return index
+
+
+def compile_controls(mappings):
+    # Inverted index over PluginComplianceMappings: standard -> control -> the test titles mapped to that control
+    controls = {}
+    for test_title, plugin_mappings in mappings.items():
+        for standard, standard_controls in plugin_mappings.get('PluginComplianceMappings', {}).items():
+            by_control = controls.setdefault(standard, {})
+            for control in standard_controls:
+                by_control.setdefault(control, []).append(test_title)
+    return {standard: {control: tuple(test_titles) for control, test_titles in by_control.items()} for standard, by_control in controls.items()}
+
+
+def load_plugin_index(rebuild = False):
+    # Lazily load the compiled mappings, recompiling the cache whenever the JSON's mtime / size and content hash change
+    if PLUGIN_INDEX is not None and not rebuild:
+        return PLUGIN_INDEX
+    with PLUGIN_INDEX_LOCK:     # Threads racing on the first lookup load it once
+        if PLUGIN_INDEX is not None and not rebuild:
+            return PLUGIN_INDEX
+        return read_plugin_index(rebuild)
+
+
+def read_plugin_index(rebuild = False):
+    # CONTROL_INDEX is always set before PLUGIN_INDEX, which is what load_plugin_index() checks without the lock
+    global PLUGIN_INDEX, CONTROL_INDEX
+    stat = MAPPINGS_FILE.stat()
+    cached = None
+    try:
+        with open(MAPPINGS_INDEX, 'rb') as file:
+            cached = pickle.load(file)
+        if not isinstance(cached, dict) or cached.get('version') != MAPPINGS_INDEX_VERSION or rebuild:
+            cached = None
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    if cached and cached['stat'] == (stat.st_mtime_ns, stat.st_size):
+        CONTROL_INDEX, PLUGIN_INDEX = cached['controls'], cached['plugins']
+        return PLUGIN_INDEX
+
+    # Stat changed (or no cache yet) - only recompile if the content actually changed
+    raw = MAPPINGS_FILE.read_bytes()
+    digest = hashlib.sha256(raw).hexdigest()
+    if cached and cached['sha256'] == digest:
+        plugins, controls = cached['plugins'], cached['controls']
+    else:
+        mappings = json.loads(raw)
+        plugins, controls = compile_mappings(mappings), compile_controls(mappings)
+    try:
+        temp = MAPPINGS_INDEX.with_suffix(f'.{os.getpid()}.tmp')
+        with open(temp, 'wb') as file:
+            pickle.dump({'version': MAPPINGS_INDEX_VERSION, 'stat': (stat.st_mtime_ns, stat.st_size), 'sha256': digest, 'plugins': plugins, 'controls': controls}, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, MAPPINGS_INDEX)
+    except OSError: # Read-only install; the compiled index simply isn't cached
+        print(f'[!] Could not write plugin mapping index \'{MAPPINGS_INDEX}\'')
+    CONTROL_INDEX, PLUGIN_INDEX = controls, plugins
+    return PLUGIN_INDEX
+
+
+def lookup_plugin(test_title):
+    return load_plugin_index().get(test_title, UNKNOWN_PLUGIN)
+
+
+def load_control_index():
+    load_plugin_index()
+    return CONTROL_INDEX
+
+
+def write_table_row(worksheet, row, values, formats, column_formats):
+    # Write a single table row starting at Column B; columns past the named formats (compliance mappings) use the 'Assets' format
+    if isinstance(formats, StaticStyles):
+        return formats.write_row(worksheet, row, values, column_formats)
+    for column, value in enumerate(values):
+        style = column_formats[column] if column < len(column_formats) else 'Assets'
+        worksheet.write(row, column+1, value, formats.get(style))
+
+
+def format_assets(assets, limit = None, max_length = ASSET_CELL_LENGTH):
+    # Affected assets cell text, one asset per line with its repeat count. Lists at most `limit` assets and `max_length`
+    # characters; returns the text and the (asset, count) pairs left out of it
+    lines, length = [], 0
+    items = list(assets.items())
+    for index, (asset, count) in enumerate(items):
+        line = asset if count == 1 else f'{asset} (x{count})'
+        if (limit and index >= limit) or (max_length and length + len(line) > max_length):
+            return '\n'.join(lines), items[index:]
+        lines.append(line)
+        length += len(line) + 1
+    return '\n'.join(lines), []
+
+
+def append_row(worksheet, row, formats, test_title, test_assets, standards, chart_data):
+    # Lookup CloudSploit plugin information (already normalized) from test title
+    domain, severity, description, remediation, compliance = lookup_plugin(test_title)
+
+    # Columns B-G (test_assets is the cell text from format_assets()), then the compliance standards (Columns H+)
+    values = [domain, test_title, severity, description, remediation, test_assets]
+    for standard in standards:
+        values.append(compliance.get(standard, ''))
+    write_table_row(worksheet, row, values, formats, OBSERVATION_FORMATS)
 
     # Update chart data
-    CHART_DATA[0][domain] = CHART_DATA[0].get(domain, 0) + 1
-    CHART_DATA[1][severity] = CHART_DATA[1].get(severity, 0) + 1
+    chart_data[0][domain] = chart_data[0].get(domain, 0) + 1
+    chart_data[1][severity] = chart_data[1].get(severity, 0) + 1
 
     # Return current number of rows in the worksheet
-    return len(titles)
+    return row + 1
 
 
 def format_sheet(worksheet, rows, formats, end_column, is_statistics=False):
+    if isinstance(formats, StaticStyles):
+        # Cells already carry their final format; only the bottom table border row is left to write
+        formats.write_row(worksheet, rows, [None]*(ord(end_column) - ord('B')), [], last_row=True)
+        return format_columns(worksheet, end_column, is_statistics)
+
     # Add Risk Level Colors
     worksheet.conditional_format(f'D1:D{rows+1}', {'type': 'cell', 'criteria': '==', 'value': '"Critical"', 'format': formats['Critical']})
     worksheet.conditional_format(f'D1:D{rows+1}', {'type': 'cell', 'criteria': '==', 'value': '"High"', 'format': formats['High']})
@@ -61,6 +222,10 @@ def format_sheet(worksheet, rows, formats, end_column, is_statistics=False):
     # Alternate table row line color & set interior borders
     worksheet.conditional_format(f'B1:{end_column}{rows+1}', {'type': 'formula', 'criteria': '=ISODD(ROW())', 'format': formats['Row']})
     worksheet.conditional_format(f'B1:{end_column}{rows+1}', {'type': 'formula', 'criteria': '=True', 'format': formats['CellBorders']})
+    return format_columns(worksheet, end_column, is_statistics)
+
+
+def format_columns(worksheet, end_column, is_statistics=False):
     # Set column widths
     worksheet.set_column(0, 0, 1)   # Left side table border
     worksheet.set_column(1, 2, 41)  # Report Observation Areas & Observation Titles
@@ -82,18 +247,21 @@ def format_sheet(worksheet, rows, formats, end_column, is_statistics=False):
     return True
 
 
-def draw_charts(workbook, chartsheet1, chartsheet2):
-    # Enter chart data into the worksheet
-    category_count = len(list(CHART_DATA[0].keys()))
-    risk_type_count = len(list(CHART_DATA[1].keys()))
+def draw_charts(workbook, chartsheet1, chartsheet2, chart_data, worksheet = None):
+    # Enter chart data (observation domain counts, risk level counts) into the worksheet
+    category_count = len(list(chart_data[0].keys()))
+    risk_type_count = len(list(chart_data[1].keys()))
     
-    # Create, fill out, and hide a worksheet to hold the chart information
-    worksheet = workbook.add_worksheet('ChartData')
+    # Create (unless reserved ahead of time), fill out, and hide a worksheet to hold the chart information
+    if worksheet is None:
+        worksheet = workbook.add_worksheet('ChartData')
     worksheet.write_row('A1', ['Observation Category', 'Category Count', 'Observation Risk', 'Risk Count'])
-    worksheet.write_column('A2', list(CHART_DATA[0].keys()))
-    worksheet.write_column('B2', list(CHART_DATA[0].values()))
-    worksheet.write_column('C2', list(CHART_DATA[1].keys()))
-    worksheet.write_column('D2', list(CHART_DATA[1].values()))
+    categories, risks = list(chart_data[0].items()), list(chart_data[1].items())
+    for row in range(max(category_count, risk_type_count)):  # Row by row so the sheet can be streamed in low memory mode
+        if row < category_count:
+            worksheet.write_row(row+1, 0, categories[row])
+        if row < risk_type_count:
+            worksheet.write_row(row+1, 2, risks[row])
     #worksheet.hide()
 
     # Draw Observation Domains Chart
@@ -125,200 +293,1195 @@ def draw_charts(workbook, chartsheet1, chartsheet2):
     return True
 
 
-def format_observations(workbook, filename, sheetname, standards, formats, accumulator = 0):
+def draw_trend_charts(workbook, chartsheet1, chartsheet2, trend_data):
+    # Trend mode counterpart of draw_charts(): new / resolved / persisting observations side by side, per domain and risk level
+    worksheet = workbook.add_worksheet('ChartData')
+    changes = list(trend_data)
+    keys = [list(dict.fromkeys([key for chart_data in trend_data.values() for key in chart_data[index]])) for index in range(2)]
+    width = len(changes) + 1
+    worksheet.write_row(0, 0, ['Observation Category'] + changes + ['Observation Risk'] + changes)
+    for row in range(max(len(keys[0]), len(keys[1]))):   # Row by row so the sheet can be streamed in low memory mode
+        for index in range(2):
+            if row < len(keys[index]):
+                key = keys[index][row]
+                worksheet.write_row(row+1, index*width, [key] + [trend_data[change][index].get(key, 0) for change in changes])
+
+    for index, (chartsheet, title) in enumerate([(chartsheet1, 'Domain'), (chartsheet2, 'Risk Level')]):
+        chart = workbook.add_chart({'type': 'bar'})
+        for offset, change in enumerate(changes, 1):
+            chart.add_series({
+                'name':       ['ChartData', 0, index*width + offset],
+                'categories': ['ChartData', 1, index*width, len(keys[index]), index*width],
+                'values':     ['ChartData', 1, index*width + offset, len(keys[index]), index*width + offset]
+            })
+        chart.set_title({'name': f'Observation Changes by {title}'})
+        chart.set_style(2)
+        chartsheet.set_chart(chart)
+        print(f'[+] Charted observation changes by {title.lower()}')
+    return True
+
+
+def get_columns(scan_type = 'cli'):
+    # These variables represent which column the data is found in within cloudsploit CSVs (title, asset, region, result)
+    return (1, 3, 4, 5) if scan_type == 'cli' else (1, 5, 3, 4)
+
+
+def detect_columns(header, sample = ()):
+    # Positions of the (title, asset, region, result) columns and the scan type of an export. The columns are found in the
+    # header row by any of their SCAN_COLUMNS names, in any order. A header without them falls back on the first rows
+    # (`sample`): the layout whose result column holds nothing but SCAN_RESULTS is the one. The scan type (and the
+    # columns, without a header naming them) is None when neither settles it, leaving it to -a
+    positions = {}
+    for index, name in enumerate(header):
+        positions.setdefault(name.strip().lower(), index)
+    columns = tuple([next((positions[name] for name in names if name in positions), None) for names in SCAN_COLUMNS.values()])
+    if None not in columns:
+        layouts = [scan_type for scan_type in SCAN_TYPES if get_columns(scan_type) == columns]
+        if not layouts:     # Columns in some other order; CLI and Aqua Wave still differ in their passing result
+            results = set([row[columns[3]] for row in sample if len(row) > columns[3]])
+            layouts = [scan_type for scan_type in SCAN_TYPES if SCAN_RESULTS[scan_type][0] in results]
+    else:
+        columns = None
+        layouts = []
+        for scan_type in SCAN_TYPES:
+            result = get_columns(scan_type)[3]
+            results = [row[result] if len(row) > result else None for row in sample if row]
+            if results and all([value in SCAN_RESULTS[scan_type] for value in results]):
+                layouts.append(scan_type)
+    if len(layouts) != 1:
+        return columns, None
+    return columns or get_columns(layouts[0]), layouts[0]
+
+
+def peek_rows(file, size = 64*1024):
+    # The first rows waiting in a binary stream, without consuming them (for detect_columns())
+    data = file.peek(size)[:size]
+    text = data[:data.rfind(b'\n') + 1].decode(SCAN_ENCODING, 'replace')
+    return list(filter(None, csv.reader(io.StringIO(text))))
+
+
+def read_columns(file, width, columns):
+    # Yield (titles, assets, regions, results) column batches from a scan's binary stream (past its header row of `width`
+    # columns), read and decoded READ_CHUNK bytes at a time. A chunk is only cut between records (an even number of quotes
+    # before the cut). A quote inside an unquoted field breaks that count, so from the first block holding one the rest of
+    # the stream goes through the csv module. Titles and results are dictionary-encoded: every repeat of a value shares one
+    # string, so the sinks hash and compare them by identity
+    strings = {}
+    encode = strings.setdefault
+    pending = b''
+    while True:
+        chunk = file.read(READ_CHUNK)
+        data = pending + chunk
+        cut = len(data) if not chunk else data.rfind(b'\n') + 1
+        if chunk and (not cut or data.count(b'"', 0, cut) % 2 and not stray_quotes(data[:cut].decode(SCAN_ENCODING))):
+            pending = data  # No complete record yet, or cut inside a quoted field
+            continue
+        block, pending = data[:cut].decode(SCAN_ENCODING), data[cut:]
+        if block and not block.isspace():
+            decoded = decode_block(block, width, columns)
+            batches = [decoded] if decoded is not None else read_csv_columns(io.BufferedReader(PrefixedReader(data, file)), columns)
+            for titles, assets, regions, results in batches:
+                yield list(map(encode, titles, titles)), assets, regions, list(map(encode, results, results))
+            if decoded is None:     # The csv module has read the rest of the stream
+                return
+        if not chunk:
+            return
+
+
+def read_csv_columns(file, columns):
+    # Column batches of the records left in a binary stream, read by the csv module (see read_columns())
+    project = operator.itemgetter(*columns)
+    rows = filter(None, csv.reader(io.TextIOWrapper(file, SCAN_ENCODING)))
+    for batch in iter(lambda: list(map(project, itertools.islice(rows, BATCH_ROWS))), []):
+        yield [list(column) for column in zip(*batch)]
+
+
+def stray_quotes(block):
+    # Whether a quote in a block of whole records sits inside an unquoted field, where the csv module reads it as text.
+    # Quotes that open a field follow a comma or newline, and between a closing and the next opening quote there is nothing
+    # else (split on quotes, the text outside quoted fields is every other part)
+    return '"' in block and any([part and not part.endswith((',', '\n')) for part in block.split('"')[0:-1:2]])
+
+
+def split_records(block, step):
+    # Split a block of whole records on commas in one go, or return None unless every record has `step` commas. Records
+    # join at the fields holding the end of one line and the start of the next, every `step` fields, so the block is
+    # regular when each of those holds exactly one of its newlines. Commas and newlines inside quoted fields are first
+    # swapped for QUOTED_STAND_INS: splitting the block on quotes leaves the quoted text at odd positions
+    if '"' in block:
+        parts = block.split('"')
+        outside = parts[0::2]
+        if not all(map(str.endswith, filter(None, parts[0:-1:2]), itertools.repeat((',', '\n')))) or not all(map(str.startswith, filter(None, outside[1:]), itertools.repeat((',', '\n', '\r\n')))):
+            return None     # A quote inside an unquoted field, or text after a closing quote
+        inside = list(map(str.replace, parts[1::2], itertools.repeat(','), itertools.repeat(QUOTED_STAND_INS[0])))
+        if '\n' in ''.join(inside):
+            inside = list(map(str.replace, inside, itertools.repeat('\r\n'), itertools.repeat('\n')))    # As the line by line split does
+            inside = list(map(str.replace, inside, itertools.repeat('\n'), itertools.repeat(QUOTED_STAND_INS[1])))
+        parts[1::2] = inside
+        block = '"'.join(parts)
+    fields = block.split(',')
+    joins = fields[step::step]
+    if len(fields) != len(joins)*step + 1 or block.count('\n') != len(joins) or not all(map(operator.contains, joins, itertools.repeat('\n'))):
+        return None
+    return fields
+
+
+def unquote(values):
+    # Field values as the csv module reads them, for a column of split_records() fields
+    if '"' not in ''.join(values):
+        return values
+    return [value[1:-1].replace('""', '"').replace(QUOTED_STAND_INS[0], ',').replace(QUOTED_STAND_INS[1], '\n') if value.startswith('"') else value for value in values]
+
+
+def decode_block(block, width, columns):
+    # Columns of a block of whole records, in file order, or None when it holds stray quotes (see stray_quotes()). Blocks
+    # are split in one go by split_records(); anything it rejects (blank lines, ragged rows) is split line by line, with
+    # only quoted records going through the csv module
+    if not block.endswith('\n'):   # Last record of a file without a trailing newline
+        block += '\n'
+    step = width - 1
+    if 0 < min(columns) and max(columns) < step and not any([stand_in in block for stand_in in QUOTED_STAND_INS]):
+        fields = split_records(block, step)     # Any '\r' stays in the fields joining records
+        if fields is not None:
+            return [unquote(fields[column::step]) for column in columns]
+    if stray_quotes(block):     # Records may have been cut inside a quoted field
+        return None
+    project = operator.itemgetter(*columns)
+    lines = list(filter(str.strip, block.replace('\r\n', '\n').split('\n')))
+    quoted = list(map(str.__contains__, lines, itertools.repeat('"')))
+    quoted_lines = list(itertools.compress(lines, quoted))
+    if any([line.count('"') % 2 for line in quoted_lines]):    # A quoted field spans lines; parse the whole block as CSV
+        rows = list(map(project, filter(None, csv.reader(io.StringIO(block.replace('\r\n', '\n'))))))
+    else:
+        plain_rows = map(project, map(str.split, itertools.compress(lines, map(operator.not_, quoted)), itertools.repeat(',')))
+        quoted_rows = map(project, csv.reader(quoted_lines))
+        rows = list(map(next, map([plain_rows, quoted_rows].__getitem__, quoted)))   # Back in file order
+    return [list(column) for column in zip(*rows)] or [[] for column in columns]
+
+
+def is_csv(filename):
+    # CSV scans, optionally gzip / zip compressed; '-' reads the scan from standard input. A zip archive only counts when it
+    # holds a CSV (checked once it exists), so workbooks zipped by -z (.xlsx.zip) and unrelated archives are not read
+    name = filename.lower()
+    if name.endswith('.xlsx.zip'):
+        return False
+    if name.endswith('.zip') and os.path.isfile(filename):
+        try:
+            with zipfile.ZipFile(filename) as archive:
+                return bool(csv_members(archive))
+        except (OSError, zipfile.BadZipFile):
+            return False
+    return filename == '-' or name.endswith(('.csv', '.csv.gz', '.zip'))
+
+
+def csv_members(archive):
+    # CSV files inside a zipped scan, in archive order
+    return [name for name in archive.namelist() if name.lower().endswith('.csv')]
+
+
+def sheet_name(target):
+    # Default worksheet name for a scan: its filename without the directory path or extensions
+    name = target.strip()
+    if name == '-':
+        return 'Observations'
+    name = name[1+name.rfind(SLASH):]
+    for extension in ('.gz', '.zip', '.csv'):
+        if name.lower().endswith(extension):
+            name = name[:-len(extension)]
+    return name.capitalize()
+
+
+class ScanDigest:
+    # sha256 of a scan file for the --cache, taken from the bytes stream_scan() reads anyway (see DigestReader) so the file
+    # is only read once. Zip archives are read out of order; their digest comes from a second read
+    def __init__(self, filename):
+        self.filename = filename
+        self.sha256 = hashlib.sha256()
+        self.in_order = True
+
+    def hexdigest(self):
+        return self.sha256.hexdigest() if self.in_order else file_digest(self.filename)
+
+
+class DigestReader(io.RawIOBase):
+    # Unbuffered file reader feeding a ScanDigest with every byte read; whatever the scan leaves unread is hashed on close
+    def __init__(self, file, digest):
+        self.file = file
+        self.digest = digest
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self.file.seekable()
+
+    def tell(self):
+        return self.file.tell()
+
+    def seek(self, offset, whence = io.SEEK_SET):
+        position = self.file.seek(offset, whence)
+        if position != self.position:
+            self.digest.in_order = False
+        return position
+
+    def readinto(self, buffer):
+        count = self.file.readinto(buffer)
+        if count and self.digest.in_order:
+            self.digest.sha256.update(memoryview(buffer)[:count])
+            self.position += count
+        return count
+
+    def close(self):
+        if not self.closed:
+            if self.digest.in_order and self.file.seek(self.position) == self.position:
+                for chunk in iter(lambda: self.file.read(1024*1024), b''):
+                    self.digest.sha256.update(chunk)
+            self.file.close()
+        super().close()
+
+
+class PrefixedReader(io.RawIOBase):
+    # Unbuffered reader that hands back bytes already taken from a stream before the rest of that stream
+    def __init__(self, prefix, file):
+        self.prefix = memoryview(prefix)    # Sliced without copying what is left
+        self.file = file
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.prefix:
+            count = min(len(buffer), len(self.prefix))
+            buffer[:count] = self.prefix[:count]
+            self.prefix = self.prefix[count:]
+            return count
+        return self.file.readinto(buffer)
+
+
+def peek_magic(raw, size = 4):
+    # First size bytes of a buffered stream, and a stream that still starts with them. peek() returns at most one read's
+    # worth, which from a slow pipe can be less than size bytes; those streams are read until size bytes (or EOF) arrive
+    magic = raw.peek(size)[:size]
+    if len(magic) == size:
+        return magic, raw
+    magic = b''
+    while len(magic) < size:
+        chunk = raw.read1(size - len(magic))
+        if not chunk:
+            break
+        magic += chunk
+    return magic, io.BufferedReader(PrefixedReader(magic, raw))
+
+
+@contextlib.contextmanager
+def open_scan(filename, digest = None):
+    # Binary stream over a scan; gzip and zip (first CSV inside the archive) scans are decompressed on the fly, from a file or stdin.
+    # The file's bytes are hashed into digest (a ScanDigest) as they are read, if one is given
+    with contextlib.ExitStack() as stack:
+        if filename == '-':
+            raw = sys.stdin.buffer
+        elif digest is None:
+            raw = stack.enter_context(open(filename, 'rb'))
+        else:
+            raw = stack.enter_context(io.BufferedReader(DigestReader(open(filename, 'rb', buffering=0), digest)))
+        magic, raw = peek_magic(raw)
+        if magic[:2] == b'\x1f\x8b':
+            yield stack.enter_context(gzip.GzipFile(fileobj=raw))
+        elif magic == b'PK\x03\x04':
+            if filename == '-':     # Zip archives need seeking (the directory is at the end), so spool stdin first
+                spooled = stack.enter_context(tempfile.SpooledTemporaryFile(64*1024*1024))
+                shutil.copyfileobj(raw, spooled)
+                raw = spooled
+            archive = stack.enter_context(zipfile.ZipFile(raw))
+            members = csv_members(archive)
+            if not members:
+                raise ValueError(f'{filename} is a zip archive without a CSV in it')
+            yield stack.enter_context(archive.open(members[0]))
+        else:
+            yield raw
+
+
+class SheetNames:
+    # Worksheet name allocator for one workbook. Names are made valid for Excel (31 characters, none of []:*?/\, no leading
+    # or trailing apostrophe) and duplicates are marked '(1)', '(2)', ... as they are handed out, so every tab can be named
+    # before the workbook exists instead of retrying xlsxwriter until a name is accepted
+    INVALID_CHARACTERS = str.maketrans('[]:*?/\\', '_'*7)
+
+    def __init__(self, reserved = ()):
+        self.used = {name.lower() for name in reserved}  # Excel compares sheet names case-insensitively
+        self.duplicates = {}    # Name -> last duplicate number handed out, so the next one is found without counting up again
+
+    def allocate(self, sheetname):
+        name = sheetname.translate(self.INVALID_CHARACTERS).strip("'")[:31] or 'Sheet'
+        if name != sheetname:
+            print(f'[!] Sheet \'{sheetname}\' has invalid name! Using \'{name}\'')
+        candidate, accumulator = name, self.duplicates.get(name.lower(), 0)
+        while candidate.lower() in self.used:
+            accumulator += 1
+            suffix = f'({accumulator})'
+            candidate = name[0:31-len(suffix)] + suffix     # Only shortened when the name and its suffix exceed 31 characters
+        if candidate != name:
+            print(f'[!] Duplicate sheet found for \'{name}\'! Marking it as \'{candidate}\'')
+            self.duplicates[name.lower()] = accumulator
+        self.used.add(candidate.lower())
+        return candidate
+
+
+def workbook_sheet_names(workbook):
+    # SheetNames for a workbook whose tabs were not planned ahead of time: only the sheets already in it are taken
+    return SheetNames([worksheet.name for worksheet in workbook.worksheets()])
+
+
+def add_named_worksheet(workbook, sheetname, names = None):
+    # Add a worksheet under the first free, valid name for sheetname. names is the workbook's SheetNames when its tabs
+    # were planned (see plan_workbooks()), so that later tabs cannot take a planned name
+    return workbook.add_worksheet((names or workbook_sheet_names(workbook)).allocate(sheetname))
+
+
+def plan_sheets(names, targets, include_statistics, multiple_targets = None):
+    # Name the observations (and pass-fail rates) tab of every target up front, in target order. A single target keeps
+    # the 'Pass-Fail Rates' tab; when the run has several (multiple_targets, by default more than one in targets), each
+    # rates tab is named after its observations tab ('<tab> Rates'), shortened to fit Excel's 31 characters
+    if multiple_targets is None:
+        multiple_targets = len(targets) > 1
+    sheets = []
+    for target in targets:
+        sheet = names.allocate(sheet_name(target))
+        rates = f'{sheet[:31-len(" Rates")]} Rates' if multiple_targets else 'Pass-Fail Rates'
+        sheets.append((sheet, names.allocate(rates) if include_statistics else None))
+    return sheets
+
+
+class Profiler:
+    # Stage timers, row counters and tracemalloc peaks per target file (--profile, or passed in by library callers). Every
+    # finished stage and target is also handed to each hook as a dict. One profiler follows a single run at a time
+    def __init__(self, hooks = (), trace_memory = True):
+        self.hooks = list(hooks)
+        self.trace_memory = trace_memory
+        self.records = {}       # Target (None for workbook-wide stages) -> seconds, rows, tracemalloc peak and stage seconds
+        self.current = None
+        self.started = time.perf_counter()
+        self.owns_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self.owns_tracing:
+            tracemalloc.start()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def record(self, target):
+        record = self.records.get(target)
+        if record is None:
+            record = self.records[target] = {'seconds': 0.0, 'rows': 0, 'tracemalloc_peak_bytes': None, 'stages': {}}
+        return record
+
+    @contextlib.contextmanager
+    def target(self, target):
+        # Stages and rows inside are attributed to target; entering the same target again adds to its totals
+        previous, self.current = self.current, target
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = self.record(target)
+            record['seconds'] += time.perf_counter() - start
+            if self.trace_memory:
+                record['tracemalloc_peak_bytes'] = max(record['tracemalloc_peak_bytes'] or 0, tracemalloc.get_traced_memory()[1])
+            self.current = previous
+            self.emit(dict(record, event='target', target=target))
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            stages = self.record(self.current)['stages']
+            stages[stage] = stages.get(stage, 0.0) + seconds
+            self.emit({'event': 'stage', 'target': self.current, 'stage': stage, 'seconds': seconds})
+
+    def count(self, rows):
+        self.record(self.current)['rows'] += rows
+
+    def emit(self, event):
+        for hook in self.hooks:
+            hook(event)
+
+    def report(self):
+        # Machine readable summary of the run so far (see --profile)
+        targets = []
+        for target, record in self.records.items():
+            if target is not None:
+                targets.append(dict(record, target=target, rows_per_second=record['rows'] / record['seconds'] if record['seconds'] else None))
+        return {
+            'total_seconds': time.perf_counter() - self.started,
+            'tracemalloc': self.trace_memory,
+            'targets': targets,
+            'workbook': self.records.get(None, self.record(None))
+        }
+
+    def close(self):
+        if self.owns_tracing:
+            tracemalloc.stop()
+            self.owns_tracing = False
+        return self.report()
+
+
+class NullProfiler:
+    # Stand-in used while profiling is off; stateless, so a single instance is shared
+    context = contextlib.nullcontext()
+
+    def target(self, target):
+        return self.context
+
+    def stage(self, stage):
+        return self.context
+
+    def count(self, rows):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class ScanSink:
+    # A consumer fed by stream_scan(); every sink sees the same rows from a single pass over the CSV. Projected sinks get
+    # (title, asset, region, result) rows (see SCAN_COLUMNS), batches of them as (titles, assets, regions, results) columns;
+    # the others get every column of every row
+    projected = True
+
+    def header(self, entry, scan_type):
+        pass
+
+    def feed(self, entry):
+        pass
+
+    def feed_batch(self, entries):
+        feed = self.feed
+        for entry in entries:
+            feed(entry)
+
+    def feed_columns(self, columns):
+        self.feed_batch(list(zip(*columns)))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        return True
+
+
+class GroupedSink(ScanSink):
+    # Groups rows by test title in a dict, so results are correct whatever order the CSV is in. Rows come out in order of
+    # first appearance, which for a CSV sorted by test title is the sorted order. With presorted=True the open group is
+    # emitted as soon as a new title shows up, keeping only one group in memory at a time
+    def __init__(self, presorted = False):
+        self.groups = {}
+        self.presorted = presorted
+
+    def group(self, test_title, factory):
+        group = self.groups.get(test_title)
+        if group is None:
+            if self.presorted and self.groups:
+                self.flush()
+            group = self.groups[test_title] = factory()
+        return group
+
+    def merge(self, groups):
+        # Fold in groups aggregated elsewhere (another target file or a worker process); the same test becomes a single row
+        for test_title, group in groups.items():
+            self.combine(self.group(test_title, self.new_group), group)
+
+    def collect(self):
+        # Current groups, for handing to another sink's merge() (see aggregate_groups())
+        return self.groups
+
+    def flush(self):
+        for test_title, group in self.groups.items():
+            self.emit(test_title, group)
+        self.groups.clear()
+
+    def new_group(self):
+        return None
+
+    def combine(self, group, other):
+        pass
+
+    def emit(self, test_title, group):
+        pass
+
+
+class ObservationsSink(GroupedSink):
+    # Aggregates failed tests (and the assets they affect) into the observations sheet, one row per test. Each test keeps
+    # its distinct assets (interned, as the same regions / ARNs repeat across tests) with a count of failing results
+    def __init__(self, worksheet, standards, formats, chart_data = None, presorted = False, scan_type = 'cli', assets = None, controls = None):
+        super().__init__(presorted)
+        self.worksheet = worksheet
+        self.formats = formats
+        self.standards = standards
+        self.chart_data = [{},{}] if chart_data is None else chart_data
+        self.assets = assets    # AssetSheet taking the assets that do not fit in a test's cell
+        self.controls = controls    # CompliancePivot collecting the failed tests of the whole run
+
+        # Column A/H are table borders; B-G hold the observation, compliance mappings follow after G
+        headers = ['Report Observation Domain', 'Observation Title', 'Risk Level', 'Report Observation Description', 'Remediation Effort', 'Affected Assets']
+        write_table_row(worksheet, 0, headers + list(standards), formats, OBSERVATION_FORMATS[:-1] + [None])
+        self.row = 1
+
+    def new_group(self):
+        return {}   # Asset -> failing results, for a single test
+
+    def combine(self, group, other):
+        for asset, count in other.items():
+            asset = sys.intern(asset)   # Unpickled groups (cache / worker processes) are not interned
+            group[asset] = group.get(asset, 0) + count
+
+    def feed(self, entry):
+        self.feed_columns([[value] for value in entry])
+
+    def feed_columns(self, columns):
+        # Count each failing (test, asset) pair of the batch at once; pairs come out in order of first appearance, so tests
+        # and their assets keep the order of a row by row pass. The asset is the region when no asset is listed
+        titles, assets, regions, results = columns
+        failing = itertools.compress(zip(titles, assets, regions), map('FAIL'.__eq__, results))
+        failed = collections.Counter([(title, region if asset == 'N/A' else asset) for title, asset, region in failing])
+        groups = self.groups
+        for (test_title, asset), count in failed.items():
+            current_assets = groups.get(test_title)
+            if current_assets is None:
+                current_assets = self.group(test_title, self.new_group)
+            asset = sys.intern(asset)
+            current_assets[asset] = current_assets.get(asset, 0) + count
+
+    def emit(self, test_title, current_assets):
+        if self.controls is not None:
+            self.controls.add(test_title, current_assets)
+        text, overflow = format_assets(current_assets, self.assets.limit if self.assets else None)
+        if overflow and self.assets:
+            text += f'\n... and {len(overflow)} more in the \'{self.assets.write(self.worksheet.name, test_title, overflow)}\' tab'
+        elif overflow:
+            text += f'\n... and {len(overflow)} more'
+        self.row = append_row(self.worksheet, self.row, self.formats, test_title, text, self.standards, self.chart_data)
+
+    def close(self):
+        self.flush()
+        if self.row == 1: # No failed tests; the sheet has always carried a single blank observation row in that case
+            self.emit('', {})
+        table_end_column = chr(ord('H') + len(self.standards))
+        return format_sheet(self.worksheet, self.row, self.formats, table_end_column)
+
+
+class StatisticsSink(GroupedSink):
+    # Counts passing / failing results per test for the 'Pass-Fail Rates' sheet, one row per test
+    def __init__(self, worksheet, standards, formats, presorted = False, scan_type = 'cli'):
+        super().__init__(presorted)
+        self.worksheet = worksheet
+        self.formats = formats
+        self.standards = standards
+        self.passing = 'OK' if scan_type == 'cli' else 'PASS'
+
+        # Columns B-D match the observation sheet, E-G hold success count, fail count and pass rate, compliance mappings follow
+        headers = ['Report Observation Domain', 'Observation Title', 'Risk Level', 'Success Count', 'Fail Count', 'Pass Rate']
+        write_table_row(worksheet, 0, headers + list(standards), formats, STATISTICS_FORMATS)
+        self.row = 1
+
+    def new_group(self):
+        return [0, 0, 0]    # Passes, fails and total entries for a single test
+
+    def combine(self, group, other):
+        for index in range(3):
+            group[index] += other[index]
+
+    def header(self, entry, scan_type):
+        self.passing = 'OK' if scan_type == 'cli' else 'PASS'   # Scan type sniffed from this file's header
+
+    def feed(self, entry):
+        test_title, result = entry[0], entry[3]
+        counts = self.groups.get(test_title)
+        if counts is None:
+            counts = self.group(test_title, self.new_group)
+
+        # Count pass / fail / total entries for each test
+        counts[2] += 1
+        if result == 'FAIL':
+            counts[1] += 1
+        if result == self.passing:
+            counts[0] += 1
+
+    def feed_columns(self, columns):
+        # Same counts, taken per distinct (test, result) pair of the batch; pairs come out in order of first appearance
+        groups = self.groups
+        for (test_title, result), count in collections.Counter(zip(columns[0], columns[3])).items():
+            counts = groups.get(test_title)
+            if counts is None:
+                counts = self.group(test_title, self.new_group)
+            counts[2] += count
+            if result == 'FAIL':
+                counts[1] += count
+            if result == self.passing:
+                counts[0] += count
+
+    def emit(self, test_title, counts):
+        domain, severity, description, remediation, compliance = lookup_plugin(test_title)
+        current_passes, current_fails, total_entries_for_test = counts
+
+        # Add worksheet row entries, then the compliance mappings
+        values = [domain, test_title, severity, current_passes, current_fails, current_passes / total_entries_for_test]
+        for standard in self.standards:
+            values.append(compliance.get(standard, ''))
+        write_table_row(self.worksheet, self.row, values, self.formats, STATISTICS_FORMATS)
+        self.row += 1
+
+    def close(self):
+        self.flush()
+        table_end_column = chr(ord('H') + len(self.standards))
+        return format_sheet(self.worksheet, self.row, self.formats, table_end_column, True) # True because writing statistics sheet
+
+
+class ColumnarStatisticsSink(StatisticsSink):
+    # Columnar backend for the 'Pass-Fail Rates' sheet: the title and result columns of each batch are dictionary-encoded
+    # (one code per distinct title / result pair) into a compact array('I') without a Python-level loop, then counted
+    # with a single vectorized group-by - numpy.bincount when NumPy is installed (imported on first use), collections.Counter
+    # otherwise. Without NumPy it is slower than the default loop backend
+    def __init__(self, worksheet, standards, formats, presorted = False, scan_type = 'cli'):
+        super().__init__(worksheet, standards, formats, scan_type=scan_type)   # Codes only collapse into groups on flush, so presorted has no effect
+        self.reset()
+
+    def reset(self):
+        self.pairs = collections.defaultdict(itertools.count().__next__)   # (Test title, result) -> code, in order of first appearance
+        self.codes = array.array('I')
+
+    def feed(self, entry):
+        self.feed_columns([[value] for value in entry])
+
+    def feed_columns(self, columns):
+        self.codes.extend(map(self.pairs.__getitem__, zip(columns[0], columns[3])))
+
+    def collect(self):
+        if not self.codes:
+            return self.groups
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if numpy is not None:
+            counts = numpy.bincount(numpy.frombuffer(self.codes, dtype=numpy.uint32), minlength=len(self.pairs)).tolist()
+        else:
+            counts = [0]*len(self.pairs)
+            for code, count in collections.Counter(self.codes).items():
+                counts[code] = count
+
+        # Titles first appear in the same order as their first pair, so rows keep the same order as StatisticsSink
+        for (test_title, result), code in self.pairs.items():
+            counts_for_test = self.group(test_title, self.new_group)
+            if result == 'FAIL':
+                counts_for_test[1] += counts[code]
+            if result == self.passing:
+                counts_for_test[0] += counts[code]
+            counts_for_test[2] += counts[code]
+        self.reset()
+        return self.groups
+
+    def flush(self):
+        self.collect()
+        return super().flush()
+
+
+def new_statistics_sink(worksheet, standards, formats, options, presorted = False):
+    # Build the 'Pass-Fail Rates' sink for the selected --stats-backend
+    backend = ColumnarStatisticsSink if options.statistics_backend == 'columnar' else StatisticsSink
+    return backend(worksheet, standards, formats, presorted, options.scan_type)
+
+
+class RawOutputSink(ScanSink):
+    # Copies every CSV row (headers included) to the 'Raw Output' sheet as it streams past. Past max_rows rows, the copy
+    # continues on 'Raw Output (2)', 'Raw Output (3)', ... with the headers repeated
+    projected = False
+
+    def __init__(self, workbook, max_rows = EXCEL_MAX_ROWS, names = None):
+        self.workbook = workbook
+        self.names = names
+        self.max_rows = max_rows
+        self.headers = None
+        self.sheets = 0
+        self.next_sheet()
+
+    def next_sheet(self):
+        self.sheets += 1
+        if self.sheets == 1:
+            self.worksheet = self.workbook.add_worksheet('Raw Output')
+        else:
+            self.worksheet = add_named_worksheet(self.workbook, f'Raw Output ({self.sheets})', self.names)
+        self.row = 0
+        if self.headers is not None:
+            self.worksheet.write_row(0, 0, self.headers)
+            self.row = 1
+
+    def header(self, entry, scan_type):
+        self.feed(entry)
+        self.headers = entry
+
+    def feed(self, entry):
+        if self.row >= self.max_rows:
+            self.next_sheet()
+        self.worksheet.write_row(self.row, 0, entry)
+        self.row += 1
+
+
+class AssetSheet:
+    # Spill-over 'Assets' tab for affected assets left out of an observation's cell (past the --max-assets cap or Excel's
+    # cell length limit), shared by every observations tab in the workbook. Continues on 'Assets (2)', ... once a tab holds
+    # max_rows rows. Tab names are allocated as the rows reach them, since observation cells point to them, but the rows
+    # are held back (pickled to a temporary file every BATCH_ROWS rows) and written by close(), after every target's tabs
+    def __init__(self, workbook, limit = None, max_rows = EXCEL_MAX_ROWS, names = None):
+        self.workbook = workbook
+        self.names = names
+        self.limit = limit      # Most assets listed in a single cell; None keeps only the cell length limit
+        self.max_rows = max_rows
+        self.sheets = []        # Allocated tab names
+        self.row = max_rows     # Next row on the last tab; the first spilled asset starts a tab
+        self.pending = []       # (Worksheet, test title, asset, count) rows not yet spooled
+        self.spool = None
+
+    def next_sheet(self):
+        sheet = 'Assets' if not self.sheets else f'Assets ({len(self.sheets) + 1})'
+        self.names = self.names or workbook_sheet_names(self.workbook)
+        self.sheets.append(self.names.allocate(sheet))
+        self.row = 1
+
+    def write(self, sheetname, test_title, assets):
+        if self.row >= self.max_rows:
+            self.next_sheet()
+        first = self.sheets[-1]     # Tab the test's spilled assets start on
+        for asset, count in assets:
+            if self.row >= self.max_rows:
+                self.next_sheet()
+            self.pending.append((sheetname, test_title, asset, count))
+            self.row += 1
+        if len(self.pending) >= BATCH_ROWS:
+            self.spool = self.spool or tempfile.TemporaryFile()
+            pickle.dump(self.pending, self.spool, pickle.HIGHEST_PROTOCOL)
+            self.pending = []
+        return first
+
+    def batches(self):
+        if self.spool:
+            self.spool.seek(0)
+            with self.spool:
+                while True:
+                    try:
+                        yield pickle.load(self.spool)
+                    except EOFError:
+                        break
+        yield self.pending
+
+    def close(self):
+        # Add the allocated tabs and write the held rows; returns the number of tabs written
+        rows = itertools.chain.from_iterable(self.batches())
+        for sheet in self.sheets:
+            print(f'[+] Writing affected assets that do not fit in their observation to \'{sheet}\' tab')
+            worksheet = self.workbook.add_worksheet(sheet)
+            worksheet.write_row(0, 0, ['Worksheet', 'Observation Title', 'Affected Asset', 'Count'])
+            worksheet.set_column(0, 1, 41)
+            worksheet.set_column(2, 2, 100)
+            worksheet.freeze_panes(1, 0)
+            for row, values in enumerate(itertools.islice(rows, self.max_rows - 1), 1):
+                worksheet.write_row(row, 0, values)
+        written = len(self.sheets)
+        self.sheets, self.row, self.pending, self.spool = [], self.max_rows, [], None
+        return written
+
+
+class CompliancePivot:
+    # Compliance control tabs, one per selected standard: every control with a failing test, with the number of failing
+    # tests, distinct affected assets and the worst severity among them. Failed tests are collected as the observation
+    # sinks emit them, then each control's tests come from the inverted CONTROL_INDEX rather than a scan of every row
+    def __init__(self, standards):
+        self.standards = standards
+        self.failed = {}    # Test title -> affected assets, across every target
+
+    def add(self, test_title, assets):
+        if not test_title:  # Blank row of a sheet without failures
+            return
+        current = self.failed.get(test_title)
+        if current is None:
+            self.failed[test_title] = set(assets)
+        else:
+            current.update(assets)
+
+    def rows(self, standard):
+        rows = []
+        for control, test_titles in load_control_index().get(standard, {}).items():
+            failing = [test_title for test_title in test_titles if test_title in self.failed]
+            if not failing:
+                continue
+            severities = [lookup_plugin(test_title)[1] for test_title in failing]
+            worst = min(severities, key=lambda severity: SEVERITY_RANKS.get(severity.lower(), len(SEVERITY_RANKS)))
+            assets = set().union(*[self.failed[test_title] for test_title in failing])
+            rows.append([control, '\n'.join(failing), worst, len(failing), len(assets)])
+        rows.sort(key=lambda row: (SEVERITY_RANKS.get(row[2].lower(), len(SEVERITY_RANKS)), -row[3], -row[4], row[0]))
+        return rows
+
+    def write(self, workbook, formats, names = None):
+        for standard in self.standards:
+            sheet = f'{standard} Controls'
+            print(f'[+] Writing failing {standard} controls to \'{sheet}\' tab')
+            worksheet = add_named_worksheet(workbook, sheet, names)
+            headers = ['Compliance Control', 'Failing Tests', 'Worst Severity', 'Failing Test Count', 'Affected Asset Count']
+            write_table_row(worksheet, 0, headers, formats, PIVOT_FORMATS)
+            row = 1
+            for values in self.rows(standard):
+                write_table_row(worksheet, row, values, formats, PIVOT_FORMATS)
+                row += 1
+            format_sheet(worksheet, row, formats, 'G', True)
+        return len(self.standards)
+
+
+@contextlib.contextmanager
+def paused_gc():
+    # Decoded batches and the groups they feed are millions of small objects without reference cycles; left on, the cyclic
+    # garbage collector would walk them over and over as they pile up. The switch is process-wide, so only the CLI opts in
+    # (pause_gc) where nothing else runs alongside; library callers such as aggregate() leave the collector alone
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def stream_scan(filename, sinks, close = True, profiler = NULL_PROFILER, scan_type = 'cli', digest = None, pause_gc = False):
+    # Single pass over a CloudSploit CSV; each row is handed to every sink, then (unless more files follow) each sink finishes
+    # its sheet. The layout is sniffed from the header (scan_type is the fallback, see detect_columns()); unless a sink needs
+    # every column, only the SCAN_COLUMNS are decoded (see read_columns()). digest is passed on to open_scan(); pause_gc
+    # turns the cyclic garbage collector off for the pass (see paused_gc())
+    with open_scan(filename, digest) as file, (paused_gc() if pause_gc else contextlib.nullcontext()):
+        entry = next(csv.reader(file.readline().decode(SCAN_ENCODING).splitlines()), None)  # First row (CSV headers)
+        full = not all([sink.projected for sink in sinks])      # Raw output needs every column of every row
+        batches = iter(())
+        if entry is not None:
+            columns, detected = detect_columns(entry, peek_rows(file))
+            if detected is None:
+                columns, detected = columns or get_columns(scan_type), scan_type
+                print(f'[!] Could not tell the layout of {filename.strip()} from its header or results, reading it as {SCAN_LABELS[scan_type]} (-a)')
+            elif detected != scan_type:
+                print(f'[!] {filename.strip()} has {SCAN_LABELS[detected]} columns, reading it as such')
+            for sink in sinks:
+                sink.header(entry, detected)
+            if full:
+                lines = csv.reader(io.TextIOWrapper(file, SCAN_ENCODING))
+                batches = iter(lambda: list(itertools.islice(lines, BATCH_ROWS)), [])
+            else:
+                batches = read_columns(file, len(entry), columns)
+        while True:
+            with profiler.stage('read'):
+                batch = next(batches, None)
+                if full and batch and any([sink.projected for sink in sinks]):
+                    rows = list(filter(None, batch))    # Blank lines have no columns to project
+                    projected = [list(map(operator.itemgetter(column), rows)) for column in columns]
+                else:
+                    projected = batch
+            if batch is None:
+                break
+            profiler.count(len(batch) if full else len(batch[0]))
+            with profiler.stage('aggregate'):   # Includes rows written as they stream (raw output, --sorted-input)
+                for sink in sinks:
+                    if sink.projected:
+                        sink.feed_columns(projected)
+                    else:
+                        sink.feed_batch(batch)
+    if not close:
+        return True
+    with profiler.stage('write'):           # Mapping lookups and table rows
+        for sink in sinks:
+            sink.flush()
+    with profiler.stage('format'):          # Conditional formats / borders and column layout
+        return all([sink.close() for sink in sinks])
+
+
+class NullSheet:
+    # Worksheet stand-in for aggregation-only passes; the sinks keep their groups instead of writing rows
+    def write(self, *args):
+        pass
+
+
+class AggregateCache:
+    # On-disk cache of per-CSV groups, one pickle per input file. An entry is reused while the file's size and mtime (or,
+    # failing that, its content hash) still match; the least recently used entries are evicted past max_bytes. VERSION is
+    # bumped whenever a scan would be parsed differently, so that entries from an older parser are thrown away
+    VERSION = 3     # 3: layouts detected from the header / results (see detect_columns())
+
+    def __init__(self, directory, max_bytes = 512*1024*1024):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def entry_path(self, filename, scan_type):
+        key = f'{scan_type}:{os.path.abspath(filename)}'.encode('utf-8')
+        return self.directory / f'{hashlib.sha256(key).hexdigest()[:32]}.pickle'
+
+    def get(self, filename, scan_type):
+        path = self.entry_path(filename, scan_type)
+        try:
+            with open(path, 'rb') as file:
+                entry = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if not isinstance(entry, dict) or entry.get('version') != self.VERSION or entry.get('path') != os.path.abspath(filename):
+            return None
+
+        stat = os.stat(filename)
+        if entry['size'] != stat.st_size:
+            return None
+        if entry['mtime_ns'] != stat.st_mtime_ns and entry['sha256'] != file_digest(filename):
+            return None
+        os.utime(path)  # Mark as recently used
+        return entry['groups']
+
+    def put(self, filename, scan_type, groups, digest = None):
+        # digest is the file's ScanDigest when it was hashed while being parsed; it is read again otherwise
+        stat = os.stat(filename)
+        entry = {
+            'version': self.VERSION,
+            'path': os.path.abspath(filename),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': digest.hexdigest() if digest else file_digest(filename),
+            'groups': groups
+        }
+        path = self.entry_path(filename, scan_type)
+        temp = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            with open(temp, 'wb') as file:
+                pickle.dump(entry, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, path)
+        except OSError:
+            print(f'[!] Could not cache aggregates for \'{filename}\'')
+            return False
+        return True
+
+    def evict(self):
+        # Called once per run (see iter_target_groups()) rather than after every put(), which would list the directory each time
+        entries = []
+        for path in self.directory.glob('*.pickle'):
+            try:
+                stat = path.stat()
+                entries.append((stat.st_mtime, stat.st_size, path))
+            except OSError: # Evicted by another process
+                pass
+        total = sum([size for mtime, size, path in entries])
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+        return True
+
+
+def file_digest(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024*1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ScanOptions:
+    # How targets are parsed and aggregated; picklable, so it is handed to worker processes as-is
+    __slots__ = ('scan_type', 'statistics_backend', 'jobs', 'cache_directory', 'cache_size', 'pause_gc')
+
+    def __init__(self, scan_type = 'cli', statistics_backend = 'loop', jobs = 1, cache_directory = None, cache_size = 512*1024*1024, pause_gc = False):
+        self.scan_type = scan_type
+        self.statistics_backend = statistics_backend
+        self.jobs = jobs
+        self.cache_directory = cache_directory
+        self.cache_size = cache_size
+        self.pause_gc = pause_gc
+
+
+def aggregate_groups(filename, options, profiler = NULL_PROFILER):
+    # Parse one CSV into its observation and statistics groups (see GroupedSink), reusing the cache when the file is unchanged.
+    # The groups hold no workbook state, so this runs as-is inside worker processes
+    cache = AggregateCache(options.cache_directory, options.cache_size) if options.cache_directory else None
+    if cache:
+        with profiler.stage('cache'):
+            groups = cache.get(filename, options.scan_type)
+        if groups is not None:
+            return groups
+
+    sinks = [ObservationsSink(NullSheet(), [], {}, scan_type=options.scan_type), new_statistics_sink(NullSheet(), [], {}, options)]
+    digest = ScanDigest(filename) if cache and filename != '-' else None
+    stream_scan(filename, sinks, close=False, profiler=profiler, scan_type=options.scan_type, digest=digest, pause_gc=options.pause_gc)
+    with profiler.stage('aggregate'):
+        groups = [sink.collect() for sink in sinks]
+    if cache:
+        with profiler.stage('cache'):
+            cache.put(filename, options.scan_type, groups, digest)
+    return groups
+
+
+def iter_target_groups(targets, options, profiler = NULL_PROFILER):
+    # Yield (target, groups) in target order, parsing across a process pool when more than one job is requested. Worker
+    # processes are not profiled; the parent records how long it waited on each target instead
+    if options.jobs > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=options.jobs, initializer=tracemalloc.stop) as executor:
+            results = executor.map(aggregate_groups, targets, [options]*len(targets))
+            for target in targets:
+                with profiler.target(target), profiler.stage('wait'):
+                    groups = next(results)
+                yield target, groups
+    else:
+        for target in targets:
+            with profiler.target(target):
+                groups = aggregate_groups(target, options, profiler)
+            yield target, groups
+    if options.cache_directory:     # Once every target has been cached
+        with profiler.stage('cache'):
+            AggregateCache(options.cache_directory, options.cache_size).evict()
+
+
+def format_targets_merged(workbook, targets, standards, formats, include_statistics, options = None, chart_data = None, assets = None, profiler = NULL_PROFILER, controls = None, names = None):
+    # Merge every target into one observations (and statistics) sheet; a test failing in several files becomes a single row
+    options = options or ScanOptions()
+    targets = [target.strip() for target in targets if is_csv(target.strip())]
+    print(f'[+] Merging observations from {len(targets)} targets into \'Merged Observations\' tab')
+    sinks = [ObservationsSink(add_named_worksheet(workbook, 'Merged Observations', names), standards, formats, chart_data, assets=assets, controls=controls)]
+    if include_statistics:
+        print(f'[+] Computing pass/fail rates in \'Pass-Fail Rates\' tab')
+        sinks.append(new_statistics_sink(add_named_worksheet(workbook, 'Pass-Fail Rates', names), standards, formats, options))
+
+    for target, groups in iter_target_groups(targets, options, profiler):  # In target order, so merged rows keep a deterministic order
+        print(f'[+] Adding {target} to merged observations...')
+        with profiler.target(target), profiler.stage('merge'):
+            for sink, group in zip(sinks, groups):
+                sink.merge(group)
+    with profiler.stage('write'):
+        all([sink.close() for sink in sinks])
+    return len(sinks)
+
+
+def format_targets_grouped(workbook, targets, standards, formats, include_statistics, options = None, chart_data = None, assets = None, profiler = NULL_PROFILER, controls = None, sheets = None, names = None):
+    # Aggregate targets in worker processes and / or from the cache; only the parent writes. Tabs are named up front in
+    # target order (see plan_sheets()) unless the caller already planned them
+    options = options or ScanOptions()
+    worksheet_count = 0
+    targets = [target for target in targets if is_csv(target.strip())]
+    filenames = [target.strip() for target in targets]
+    sheets = sheets or plan_sheets(names or workbook_sheet_names(workbook), targets, include_statistics)
+    for (filename, groups), (sheet, statistics_sheet) in zip(iter_target_groups(filenames, options, profiler), sheets):   # Targets first, so the cache is evicted at the end
+        print(f'[+] Writing observations sheet to \'{sheet}\' tab for {filename}')
+        sinks = [ObservationsSink(workbook.add_worksheet(sheet), standards, formats, chart_data, assets=assets, controls=controls)]
+        if include_statistics:
+            print(f'[+] Computing pass/fail rates in \'{statistics_sheet}\' tab')
+            sinks.append(new_statistics_sink(workbook.add_worksheet(statistics_sheet), standards, formats, options))
+        with profiler.target(filename), profiler.stage('write'):
+            for sink, group in zip(sinks, groups):
+                sink.merge(group)
+                sink.close()
+        worksheet_count += len(sinks)
+    return worksheet_count
+
+
+def load_baseline_groups(baseline, options, profiler = NULL_PROFILER):
+    # Observation groups (test title -> asset counts) of an earlier run: a scan CSV, aggregated through the --cache when it
+    # is enabled, or an entry taken straight from a --cache directory (.pickle)
+    if baseline.endswith('.pickle'):
+        with profiler.target(baseline), profiler.stage('cache'):
+            with open(baseline, 'rb') as file:
+                try:
+                    entry = pickle.load(file)
+                    groups = entry['groups'][0] if isinstance(entry, dict) and entry.get('version') == AggregateCache.VERSION else None
+                except (EOFError, pickle.UnpicklingError, AttributeError, ImportError, KeyError, IndexError, TypeError):   # Not a pickle, or not one of ours
+                    groups = None
+        if not isinstance(groups, dict):
+            raise ValueError(f'\'{baseline}\' is not a cache entry from this version of the tool')
+        return groups
+    with profiler.target(baseline):
+        return aggregate_groups(baseline, options, profiler)[0]
+
+
+def diff_groups(current, baseline):
+    # Split (test title, asset) pairs into new, resolved and persisting groups; one hashed lookup per pair, so linear in
+    # the size of both runs. Asset counts come from the run the pair was found in (the current one for persisting pairs)
+    new, resolved, persisting = {}, {}, {}
+    for test_title, assets in current.items():
+        previous = baseline.get(test_title, {})
+        for asset, count in assets.items():
+            (persisting if asset in previous else new).setdefault(test_title, {})[asset] = count
+    for test_title, assets in baseline.items():
+        now = current.get(test_title, {})
+        for asset, count in assets.items():
+            if asset not in now:
+                resolved.setdefault(test_title, {})[asset] = count
+    return new, resolved, persisting
+
+
+def count_observations(groups):
+    # Unique observations by domain (index 0) and risk level (index 1), as in ObservationsSink's chart data
+    chart_data = [{},{}]
+    for test_title in groups:
+        domain, severity = lookup_plugin(test_title)[:2]
+        chart_data[0][domain] = chart_data[0].get(domain, 0) + 1
+        chart_data[1][severity] = chart_data[1].get(severity, 0) + 1
+    return chart_data
+
+
+def format_targets_trend(workbook, targets, baseline, standards, formats, include_statistics, options = None, assets = None, profiler = NULL_PROFILER, controls = None, names = None):
+    # Compare the merged targets against a baseline run: 'New', 'Resolved' and 'Persisting' observation tabs. Returns the
+    # number of tabs written and the chart data of each tab for draw_trend_charts()
+    options = options or ScanOptions()
+    targets = [target.strip() for target in targets if is_csv(target.strip())]
+    print(f'[+] Comparing observations from {len(targets)} targets against baseline {baseline}')
+    current = [ObservationsSink(NullSheet(), [], {}, scan_type=options.scan_type), new_statistics_sink(NullSheet(), [], {}, options)]
+    for target, groups in iter_target_groups(targets, options, profiler):
+        with profiler.target(target), profiler.stage('merge'):
+            for sink, group in zip(current, groups):
+                sink.merge(group)
+    previous = load_baseline_groups(baseline, options, profiler)
+
+    with profiler.stage('diff'):
+        changes = dict(zip(['New', 'Resolved', 'Persisting'], diff_groups(current[0].collect(), previous)))
+    trend_data = {}
+    with profiler.stage('write'):
+        for sheet, groups in changes.items():
+            print(f'[+] Writing {len(groups)} {sheet.lower()} observations to \'{sheet}\' tab')
+            sink = ObservationsSink(add_named_worksheet(workbook, sheet, names), standards, formats, assets=assets, controls=controls if sheet != 'Resolved' else None)
+            sink.merge(groups)
+            sink.close()
+            trend_data[sheet] = count_observations(groups)
+        if include_statistics:
+            print(f'[+] Computing pass/fail rates in \'Pass-Fail Rates\' tab')
+            sink = new_statistics_sink(add_named_worksheet(workbook, 'Pass-Fail Rates', names), standards, formats, options)
+            sink.merge(current[1].collect())
+            sink.close()
+    return len(changes) + include_statistics, trend_data
+
+
+def format_observations(workbook, filename, sheetname, standards, formats, chart_data = None, scan_type = 'cli'):
     # Ensure that the target file is indeed a CSV
-    if filename[1+filename.rfind('.')::].lower() != 'csv':
+    if not is_csv(filename):
         print('[!] File not CSV, skipping!')
         return False
-    
-    # These variables represent which column the data is found in within cloudsploit CSVs ()
-    title, asset, region, result = (1, 3, 4, 5) if SCAN_TYPE == 'cli' else (1, 5, 3, 4)
+
     print(f'[+] Writing observations sheet to \'{sheetname}\' tab')
-    try:
-        # Add worksheet to the xlsx file; Initialize number of rows in the worksheet
-        worksheet = workbook.add_worksheet(sheetname)
-        row_count = 0
-        with open(filename) as file:
-            lines = csv.reader(file)
-            
-            # Worksheet columns are abstracted as lists Column A/H are table borders
-            domains =   ['Report Observation Domain']           # Column B, Observation domain assigned to a test
-            titles =  ['Observation Title']                     # Column C, Title of the test
-            risks = ['Risk Level']                              # Column D, Default risk level for the test before consultant review
-            descriptions = ['Report Observation Description']   # Column E, Observation descriptions (To be filled in by consultant)
-            efforts = ['Remediation Effort']                    # Column F, Remediation efforts (to be filled in by consultant)
-            assets = []                                         # Column G, Assets affected (or region if no asset specified) by the failed test
-            
-            compliance_standards = {}                           # Columns after G - compliance mappings
-            for standard in standards:
-                compliance_standards[standard] = [standard]     # List with first element as the compliance standard's name
-
-            current_assets = []     # Temp container for aggregating assets affected by a single test
-            prior_test = ''         # Temp variable to hold previous test title
-            initialized = False     # Used to make sure we fetch the first Test title and don't append an empty row
-            lines.__next__()        # Skip first row (CSV headers)
-            for entry in lines:
-                if entry[result] == 'FAIL':
-                    # Make sure we get the first failed test title and don't append an empty row
-                    if not initialized:
-                        prior_test = entry[title]
-                        initialized = True
-
-                    # Check if current entry is for a new test
-                    if entry[title] != prior_test:
-                        append_row(domains, titles, risks, descriptions, efforts, assets, prior_test, current_assets, compliance_standards)
-
-                        current_assets.clear()
-                        prior_test = entry[title]
-                        
-                    # Get the asset (if applicable) or region affected (if no asset listed)
-                    current_assets.append(entry[region]) if (entry[asset] == 'N/A') else current_assets.append(entry[asset])
-            # Must write final row after the loop breaks
-            row_count = append_row(domains, titles, risks, descriptions, efforts, assets, prior_test, current_assets, compliance_standards)
-            
-            # Write parsed data to the worksheet
-            worksheet.write_column('B1', domains, formats['Text'])
-            worksheet.write_column('C1', titles, formats['Text'])
-            worksheet.write_column('D1', risks, formats['Center'])
-            worksheet.write_column('E1', descriptions, formats['Text'])
-            worksheet.write_column('F1', efforts, formats['Text'])
-            worksheet.write_column('G1', ['Affected Assets'])
-            worksheet.write_column('G2', assets, formats['Assets']) # End with()
-            
-            # Now generate the compliance standard columns TODO: Figure out how to write compiance mappings by row
-            next_column = int.from_bytes('H'.encode('utf-8'), 'little')
-            for standard in compliance_standards.keys():
-                worksheet.write_column(f'{chr(next_column)}1', compliance_standards[standard], formats['Assets'])
-                next_column += 1
-            table_end_column = chr(next_column)
-
-        return format_sheet(worksheet, row_count, formats, table_end_column)
-
-    except xlsxwriter.exceptions.InvalidWorksheetName: # Probably too long (>31 characters)
-        print(f'[!] Sheet \'{sheetname}\' has  invalid name! Attempting to trim')
-        if len(sheetname) > 31:
-            sheetname = sheetname[0:31]
-        else:
-            sheetname = input(f'[!] Sheet \'{sheetname}\' is still invalid! Enter new valid name for the sheet: ')
-        return format_observations(workbook, filename, sheetname, standards, formats)
-    except xlsxwriter.exceptions.DuplicateWorksheetName: # Sheet with the same name already created
-        print(f'[!] Duplicate sheet found for \'{sheetname}\'! Attempting to mark duplicate!')
-        accumulator += 1
-        sheetname = sheetname[0:len(sheetname)-(len(str(accumulator))+2)] # Must account for multi-digit numbers as well as the two parenthesis
-        sheetname += f'({accumulator})'
-        return format_observations(workbook, filename, sheetname, standards, formats, accumulator)
-    except xlsxwriter.exceptions.FileCreateError:
-        print(f'[x] Could not create file {filename}!')
-        exit()
-
-
-def format_statistics(workbook, filename, sheetname, standards, formats):
+    worksheet = add_named_worksheet(workbook, sheetname)
+    return stream_scan(filename, [ObservationsSink(worksheet, standards, formats, chart_data, scan_type=scan_type)], scan_type=scan_type)
+
+
+def format_statistics(workbook, filename, sheetname, standards, formats, options = None):
     # Ensure that the target file is indeed a CSV
-    if filename[1+filename.rfind('.')::].lower() != 'csv':
+    if not is_csv(filename):
         print('[!] File not CSV, skipping!')
         return False
 
     print(f'[+] Computing pass/fail rates in \'Pass-Fail Rates\' tab')
-    # These variables represent which column the data is found in within cloudsploit CSVs ()
-    title, asset, region, result = (1, 3, 4, 5) if SCAN_TYPE == 'cli' else (1, 5, 3, 4)
-    passing = 'OK' if SCAN_TYPE == 'cli' else 'PASS'
-    try:
-        worksheet = workbook.add_worksheet(f'Pass-Fail Rates')
-        lines = None
-        domains = ['Report Observation Domain'] # Column B, category of test; same as in observtaion sheet
-        titles = ['Observation Title']          # Column C, title of test; same as in observation sheet
-        risks = ['Risk Level']                  # Column D, severity of failed test; same as in observation sheet
-        pass_count = ['Success Count']          # Column E, number of instances where the test returned a passing result
-        fail_count = ['Fail Count']             # Column F, number of instances where test returned a failed result
-        success_rate = ['Pass Rate']            # Column G, percentage of pass / fail rate
-            
-        compliance_standards = {}                           # Columns after G - compliance mappings
-        for standard in standards:
-            compliance_standards[standard] = [standard]     # List with first element as the compliance standard's name
-
-        with open(filename) as file:
-            lines = csv.reader(file)
-
-            prior_test = ''         # Temp variable to hold previous test title
-            initialized = False     # Used to make sure we fetch the first Test title and don't append an empty row
-            current_passes, current_fails, total_entries_for_test, row_count = 0, 0, 0, 0
-            lines.__next__()        # Skip first row (CSV headers)
-            for entry in lines:
-                # Make sure we get the first failed test title and don't append an empty row
-                if not initialized:
-                    prior_test = entry[title]
-                    initialized = True
-                
-                if entry[title] != prior_test: # Went through all of the current test results; add to worksheet & reset counters
-                    plugin_mappings = MAPPINGS.get(prior_test, {})
-                    domain = plugin_mappings.get('PluginDomain', 'Unknown').replace('[DEFAULT]', 'Unknown')
-                    severity = plugin_mappings.get('PluginSeverity', 'Unknown').replace('[DEFAULT] ', '').capitalize()
-
-                    # Add worksheet row entries
-                    domains.append(domain)
-                    titles.append(prior_test)
-                    risks.append(severity)
-                    pass_count.append(f'{current_passes}')
-                    fail_count.append(f'{current_fails}')
-                    rate = (current_passes / total_entries_for_test)
-                    success_rate.append(rate)
-                    row_count += 1 # Rows on final statistics sheet
-
-                    # Add compliance mappings
-                    for standard in compliance_standards.keys():
-                        mappings = plugin_mappings.get('PluginComplianceMappings', {}).get(standard, [])
-                        compliance_standards[standard].append('\n'.join(mappings))
-
-                    # Reset counters & update prior test name
-                    current_passes, current_fails, total_entries_for_test = 0, 0, 0
-                    prior_test = entry[title]
-
-                # Count pass / fail / total entries for each test
-                total_entries_for_test += 1
-                if entry[result] == 'FAIL':
-                    current_fails += 1
-                if entry[result] == passing:
-                    current_passes += 1
-            # END LOOP
-            
-            # After loop breaks, must account for the last test run - I know, horrible coppy / paste practice especially since its so similar to append_row() :(
-            plugin_mappings = MAPPINGS.get(prior_test, {})
-            domain = plugin_mappings.get('PluginDomain', 'Unknown').replace('[DEFAULT]', 'Unknown')
-            severity = plugin_mappings.get('PluginSeverity', 'Unknown').replace('[DEFAULT] ', '').capitalize()
-            domains.append(domain)
-            titles.append(entry[title])
-            risks.append(severity)
-            pass_count.append(f'{current_passes}')
-            fail_count.append(f'{current_fails}')
-            rate = (current_passes / total_entries_for_test)
-            success_rate.append(rate)
-                    
-            # Add compliance mappings for the final test
-            for standard in compliance_standards.keys():
-                mappings = plugin_mappings.get('PluginComplianceMappings', {}).get(standard, [])
-                compliance_standards[standard].append('\n'.join(mappings))
-            row_count += 2 # Account for final row + the border row
-
-            # Now actually write the data stored within our lists to the worksheet
-            worksheet.write_column('B1', domains, formats['Text'])
-            worksheet.write_column('C1', titles, formats['Text'])
-            worksheet.write_column('D1', risks, formats['Center'])
-            worksheet.write_column('E1', pass_count, formats['Text'])
-            worksheet.write_column('F1', fail_count, formats['Text'])
-            worksheet.write_column('G1', success_rate, formats['Text'])
-                
-            # Now generate the compliance standard columns TODO: Figure out how to write compiance mappings by row
-            next_column = int.from_bytes('H'.encode('utf-8'), 'little')
-            for standard in compliance_standards.keys():
-                worksheet.write_column(f'{chr(next_column)}1', compliance_standards[standard], formats['Assets'])
-                next_column += 1
-            table_end_column = chr(next_column)
-            
-            return format_sheet(worksheet, row_count, formats, table_end_column, True) # True because writing statistics sheet
-
-    except xlsxwriter.exceptions.InvalidWorksheetName or xlsxwriter.exceptions.DuplicateWorksheetName as err:
-        print(f'[x] {err}')
-    return True
+    options = options or ScanOptions()
+    worksheet = add_named_worksheet(workbook, 'Pass-Fail Rates')
+    return stream_scan(filename, [new_statistics_sink(worksheet, standards, formats, options)], scan_type=options.scan_type)
 
 
 def get_targets(target_file):
@@ -330,10 +1493,15 @@ def get_targets(target_file):
 
 
 def get_targets_recursive(directory):
-    paths = list(pathlib.Path(directory).rglob('*.[cC][sS][vV]'))
+    paths = list(pathlib.Path(directory).rglob('*.[cC][sS][vV]')) + list(pathlib.Path(directory).rglob('*.[cC][sS][vV].[gG][zZ]'))
     targets = []
     for target in paths:
         targets.append(str(target))    # Cast WindowsPath to string
+    for target in pathlib.Path(directory).rglob('*.[zZ][iI][pP]'):
+        if is_csv(str(target)):
+            targets.append(str(target))
+        elif not target.name.lower().endswith('.xlsx.zip'):   # Workbooks zipped by -z are skipped quietly
+            print(f'[!] {target} holds no CSV, skipping!')
     return targets
 
 
@@ -344,151 +1512,873 @@ def print_usage():
     print('\tExample: py format_cloudsploit.py -d . -o AllScans.xlsx')
     print('Optionally, add the \'-z\' flag to compress the resulting output into an additional zipped file.')
     print('\tExample: py format_cloudsploit.py -d C:\\Directory\\With\\Lots\\Of\\CSVs -z -o LargeFile.xlsx\n')    
-    exit()
+    return False
 
 
-def compress_file(filename):
-    print(f'[!] Attempting to compress file \'{filename}\'')
-    compression = zipfile.ZIP_DEFLATED
-    zipped = zipfile.ZipFile(filename+'.zip', mode='w')
-    try:
-        zipped.write(filename, filename, compress_type=compression)
-    except FileNotFoundError:
-        print(f'[x] Error compressing file {filename}! Exiting!')
-    finally:
-        print(f'[=] Finished file compression! Wrote to {filename+".zip"}!')
-        zipped.close()
-    exit()
+class TeeWriter:
+    # Copies everything written to several streams. It has no tell(), so zipfile (inside xlsxwriter) writes it sequentially
+    def __init__(self, *streams):
+        self.streams = streams
+
+    def write(self, data):
+        for stream in self.streams:
+            stream.write(data)
+        return len(data)
+
+    def flush(self):
+        for stream in self.streams:
+            stream.flush()
+
+
+class WorkbookOutput:
+    # Where the workbook is written: a path, '-' for stdout, or any writable file object (e.g. io.BytesIO). With compress,
+    # the workbook is deflated into a zip while it is written (next to the plain file for paths, in place of it otherwise)
+    def __init__(self, output, compress = False, arcname = 'observations.xlsx'):
+        self.stack = contextlib.ExitStack()
+        stream = sys.__stdout__.buffer if output == '-' else output if hasattr(output, 'write') else None
+        if not compress:
+            self.destination = output if stream is None else stream
+        elif stream is None:
+            print(f'[!] Compressing workbook into \'{output}.zip\' as it is written')
+            zipped = self.stack.enter_context(zipfile.ZipFile(output + '.zip', 'w', zipfile.ZIP_DEFLATED))
+            member = self.stack.enter_context(zipped.open(output, 'w', force_zip64=True))
+            self.destination = TeeWriter(self.stack.enter_context(open(output, 'wb')), member)
+            self.stack.callback(print, f'[=] Finished file compression! Wrote to {output+".zip"}!')
+        else:
+            zipped = self.stack.enter_context(zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED))
+            self.destination = self.stack.enter_context(zipped.open(arcname, 'w', force_zip64=True))
+
+    def close(self):
+        self.stack.close()
+        return True
 
 
 def add_formats(workbook):
-    gray = workbook.add_format({'bg_color':'#C0C0C0'})         # Light Grey (Overall Table Rows)    
-    grey = workbook.add_format({
-        'bg_color':'#404040',
-        'bold':1,
-        'font_color':'white'   
-    })                                                          # Dark Grey (Overall Table Borders)
-    salmon = workbook.add_format({'bg_color': '#FF0066'})       # Salmon (Unknown Observation Areas)     
-    dark_red = workbook.add_format({'bg_color': '#880000'})     # Dark Red (Critical Risk)  
-    orange = workbook.add_format({'bg_color': '#AA5500'})       # Orange (High Risk)   
-    yellow = workbook.add_format({'bg_color': '#FFFF66'})       # Yellow (Moderate Risk)   
-    green = workbook.add_format({'bg_color': '#009900'})        # Green (Low Risk)    
-    blue = workbook.add_format({'bg_color': '#0099AA'})         # Blue (Informational)
-    assets = workbook.add_format({'font_size':9})               # Small Text (Affected Assets)
-    assets.set_text_wrap()
-    assets.set_align('left')
-    assets.set_align('top')
-    text = workbook.add_format()                                # Regular Text (Interior Rows)
-    text.set_text_wrap()
-    text.set_align('left')
-    text.set_align('top')
-    cell_borders = workbook.add_format({'border':1})            # Add Cell Borders
-    center = workbook.add_format()                                # Centered Text
-    center.set_align('center')
-    center.set_align('vcenter')
-    return {
-        'Row': gray,
-        'Border': grey,
-        'Unknown' : salmon,
-        'Critical': dark_red,
-        'High': orange,
-        'Moderate': yellow,
-        'Low': green,
-        'Info': blue,
-        'Assets': assets,
-        'Text': text,
-        'CellBorders': cell_borders,
-        'Center': center
-    }
+    formats = {}
+    for name, properties in FORMAT_PROPERTIES.items():
+        formats[name] = workbook.add_format(properties)
+    return formats
+
+
+class StaticStyles:
+    # Static alternative to format_sheet()'s conditional formats: the look every rule would give a table cell is worked out
+    # in Python as the cell is written, and each distinct combination of base format + matching rules becomes one shared format
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self.combinations = {}
+
+    def style(self, row, column, value, base, end_column, last_row = False):
+        # Matching rules in format_sheet() priority order; earlier rules win conflicting properties, as in Excel
+        text = value.lower() if isinstance(value, str) else None
+        rules = []
+        if column == 3 and text in RISK_LEVEL_FORMATS:
+            rules.append(RISK_LEVEL_FORMATS[text])
+        if row == 0 or column == 0 or last_row or column == end_column:
+            rules.append('Border')
+        if column >= 1 and (text == 'unknown' or (column == 3 and text == 'unrated')):
+            rules.append('Unknown')
+        if column >= 1 and row % 2 == 0:   # ISODD(ROW()) with 1-based rows
+            rules.append('Row')
+        if column >= 1:
+            rules.append('CellBorders')
+
+        key = (base, tuple(rules))
+        style = self.combinations.get(key)
+        if style is None:
+            properties = dict(FORMAT_PROPERTIES.get(base, {}))
+            for rule in reversed(rules):
+                properties.update(FORMAT_PROPERTIES[rule])
+            style = self.combinations[key] = self.workbook.add_format(properties)
+        return style
+
+    def write_row(self, worksheet, row, values, column_formats, last_row = False):
+        # Table row including its left (Column A) and right border cells
+        end_column = len(values) + 1
+        worksheet.write_blank(row, 0, None, self.style(row, 0, None, None, end_column, last_row))
+        for column, value in enumerate(values, 1):
+            base = column_formats[column-1] if column-1 < len(column_formats) else 'Assets'
+            worksheet.write(row, column, value, self.style(row, column, value, base, end_column, last_row))
+        worksheet.write_blank(row, end_column, None, self.style(row, end_column, None, None, end_column, last_row))
 
 
 def copy_raw_output(workbook, filename):
-    worksheet = workbook.add_worksheet('Raw Output')
-    with open(filename) as file:
-        lines = csv.reader(file)
-        row = 1
-        for entry in lines:
-            worksheet.write_row(f'A{row}', entry)
-            row += 1
-    return True
+    return stream_scan(filename, [RawOutputSink(workbook)])
 
 
-def format_cloudsploit(args):
-    workbook = xlsxwriter.Workbook(args.output.strip())
+class Observation:
+    # A failed test and every asset (or region) it failed for, with its plugin mappings
+    __slots__ = ('domain', 'title', 'severity', 'description', 'remediation', 'assets', 'compliance')
+
+    def __init__(self, domain, title, severity, description, remediation, assets, compliance):
+        self.domain = domain
+        self.title = title
+        self.severity = severity
+        self.description = description
+        self.remediation = remediation
+        self.assets = assets            # Asset (or region) -> failing results
+        self.compliance = compliance    # Standard -> newline joined controls, for the requested standards only
+
+
+class TestStatistics:
+    # Passing / failing result counts for a single test
+    __slots__ = ('domain', 'title', 'severity', 'passes', 'fails', 'total', 'compliance')
+
+    def __init__(self, domain, title, severity, passes, fails, total, compliance):
+        self.domain = domain
+        self.title = title
+        self.severity = severity
+        self.passes = passes
+        self.fails = fails
+        self.total = total
+        self.compliance = compliance
+
+    @property
+    def pass_rate(self):
+        return self.passes / self.total
+
+
+class Report:
+    # Aggregated results of one or more scans (see aggregate()), ready for any of the render_* functions
+    __slots__ = ('scan_type', 'standards', 'targets', 'observations', 'statistics')
+
+    def __init__(self, scan_type, standards, targets, observations, statistics):
+        self.scan_type = scan_type
+        self.standards = standards
+        self.targets = targets
+        self.observations = observations
+        self.statistics = statistics
+
+    def chart_data(self):
+        # Unique observations by domain (index 0) and by risk level (index 1), as drawn by draw_charts()
+        chart_data = [{},{}]
+        for observation in self.observations:
+            chart_data[0][observation.domain] = chart_data[0].get(observation.domain, 0) + 1
+            chart_data[1][observation.severity] = chart_data[1].get(observation.severity, 0) + 1
+        return chart_data
+
+
+def parse_standards(compliance):
+    # 'ALL' or a comma separated list of SUPPORTED_COMPLIANCE_STANDARDS
+    if not compliance:
+        return []
+    if isinstance(compliance, str):
+        if compliance == 'ALL':
+            return SUPPORTED_COMPLIANCE_STANDARDS[1:]
+        compliance = compliance.split(',')
+    standards = [standard.strip() for standard in compliance]
+    for standard in standards:
+        if standard not in SUPPORTED_COMPLIANCE_STANDARDS[1:]:
+            raise ValueError(f'Compliance standard \'{standard}\' not supported!')
+    return standards
+
+
+def aggregate(paths, standards = (), scan_type = 'cli', statistics_backend = 'loop', jobs = 1, cache_directory = None, cache_size = 512*1024*1024, profiler = NULL_PROFILER):
+    # Library entry point: merge the scans in paths into a Report without writing anything. Every call keeps its own state
+    # (the only shared data is the read-only plugin index), so it is safe to call from several threads at once
+    if scan_type not in SCAN_TYPES:
+        raise ValueError(f'Scan type \'{scan_type}\' not supported! Supported scan types are: {", ".join(SCAN_TYPES)}')
+    if statistics_backend not in STATISTICS_BACKENDS:
+        raise ValueError(f'Statistics backend \'{statistics_backend}\' not supported! Supported backends are: {", ".join(STATISTICS_BACKENDS)}')
+    standards = parse_standards(standards)
+    options = ScanOptions(scan_type, statistics_backend, jobs, cache_directory, cache_size)
+    return build_report(iter_target_groups([str(path) for path in paths], options, profiler), standards, scan_type, profiler)
+
+
+def build_report(target_groups, standards, scan_type = 'cli', profiler = NULL_PROFILER):
+    # Merge (target, groups) pairs from aggregate_groups() into a Report, in the order given
+    targets = []
+    merged = [ObservationsSink(NullSheet(), [], {}, scan_type=scan_type), StatisticsSink(NullSheet(), [], {}, scan_type=scan_type)]
+    for target, groups in target_groups:
+        targets.append(target)
+        with profiler.target(target), profiler.stage('merge'):
+            for sink, group in zip(merged, groups):
+                sink.merge(group)
+
+    observations, statistics = [], []
+    for test_title, assets in merged[0].collect().items():
+        domain, severity, description, remediation, compliance = lookup_plugin(test_title)
+        observations.append(Observation(domain, test_title, severity, description, remediation, assets, {standard: compliance.get(standard, '') for standard in standards}))
+    for test_title, (passes, fails, total) in merged[1].collect().items():
+        domain, severity, description, remediation, compliance = lookup_plugin(test_title)
+        statistics.append(TestStatistics(domain, test_title, severity, passes, fails, total, {standard: compliance.get(standard, '') for standard in standards}))
+    return Report(scan_type, standards, targets, observations, statistics)
+
+
+def render_xlsx(report, output, include_statistics = True, static_formats = False, low_memory = False, compress = False, sheetname = 'Observations', max_assets = None, profiler = NULL_PROFILER, control_pivots = False):
+    # Write a Report as the usual workbook (charts, observations and pass-fail rates tabs) to a path, '-' or a file object
+    if xlsxwriter is None:
+        raise ImportError('render_xlsx() needs the xlsxwriter package; render_jsonl() and render_sqlite() do not')
+    destination = WorkbookOutput(output, compress)
+    workbook = xlsxwriter.Workbook(destination.destination, {'constant_memory': low_memory})
     observation_categories_chart = workbook.add_chartsheet('Observation Categories')
     risk_levels_chart = workbook.add_chartsheet('Risk Levels')
-    formats = add_formats(workbook)
-    
-    # Determine scans to include
-    targets = []
-    if (args.target): # individual CSV
-        targets.append(args.target)
-    elif (args.directory):  # Directory specified - get all CSVs recursively
-        targets = get_targets_recursive(args.directory)
-    elif (args.list): # List of CSVs specified in a file
-        targets = get_targets(args.list)
+    formats = StaticStyles(workbook) if static_formats else add_formats(workbook)
+    names = SheetNames(RESERVED_SHEETS)
+
+    controls = CompliancePivot(report.standards) if control_pivots else None
+    sinks = [ObservationsSink(add_named_worksheet(workbook, sheetname, names), report.standards, formats, assets=AssetSheet(workbook, max_assets, names=names), controls=controls)]
+    sinks[0].merge({observation.title: observation.assets for observation in report.observations})
+    if include_statistics:
+        sinks.append(StatisticsSink(add_named_worksheet(workbook, 'Pass-Fail Rates', names), report.standards, formats, scan_type=report.scan_type))
+        sinks[1].merge({statistics.title: [statistics.passes, statistics.fails, statistics.total] for statistics in report.statistics})
+    with profiler.stage('write'):
+        all([sink.close() for sink in sinks])
+        sinks[0].assets.close()
+        if controls:
+            controls.write(workbook, formats, names)
+    with profiler.stage('charts'):
+        draw_charts(workbook, observation_categories_chart, risk_levels_chart, report.chart_data())
+    with profiler.stage('close'):
+        workbook.close()
+        return destination.close()
+
+
+def render_json(report, stream):
+    # Write a Report as a single JSON document
+    records = lambda items: [{name: getattr(item, name) for name in item.__slots__} for item in items]
+    json.dump({
+        'scan_type': report.scan_type,
+        'standards': report.standards,
+        'targets': report.targets,
+        'observations': records(report.observations),
+        'statistics': [dict(record, pass_rate=item.pass_rate) for record, item in zip(records(report.statistics), report.statistics)]
+    }, stream, indent=2)
+    return True
+
+
+def render_csv(report, stream, statistics = False):
+    # Write a Report's observations (or pass-fail rates) table as CSV, with the same columns as the workbook tabs
+    writer = csv.writer(stream)
+    if statistics:
+        writer.writerow(['Report Observation Domain', 'Observation Title', 'Risk Level', 'Success Count', 'Fail Count', 'Pass Rate'] + report.standards)
+        for item in report.statistics:
+            writer.writerow([item.domain, item.title, item.severity, item.passes, item.fails, item.pass_rate] + [item.compliance[standard] for standard in report.standards])
     else:
-        print_usage()
-    
-    # Determine compliance mappings
-    standards = []
-    if args.compliance:
-        if (args.compliance == 'ALL'):
-            standards = SUPPORTED_COMPLIANCE_STANDARDS
-            standards.remove('ALL')
+        writer.writerow(['Report Observation Domain', 'Observation Title', 'Risk Level', 'Report Observation Description', 'Remediation Effort', 'Affected Assets'] + report.standards)
+        for item in report.observations:
+            writer.writerow([item.domain, item.title, item.severity, item.description, item.remediation, format_assets(item.assets, max_length=None)[0]] + [item.compliance[standard] for standard in report.standards])
+    return True
+
+
+class JsonlOutput:
+    # Streams Reports as JSON Lines: a 'report' record, then one self-contained record per observation and per test, so
+    # every line can be loaded on its own. Several Reports (one per target) can follow each other in the same stream
+    def __init__(self, stream):
+        self.stream = stream
+        self.reports = 0
+
+    def write(self, report, name):
+        self.reports += 1
+        header = {'type': 'report', 'report': self.reports, 'name': name, 'scan_type': report.scan_type, 'standards': report.standards, 'targets': report.targets}
+        self.stream.write(json.dumps(header) + '\n')
+        for item in report.observations:
+            record = {'type': 'observation', 'report': self.reports}
+            record.update((name, getattr(item, name)) for name in item.__slots__)
+            self.stream.write(json.dumps(record) + '\n')
+        for item in report.statistics:
+            record = {'type': 'statistics', 'report': self.reports}
+            record.update((name, getattr(item, name)) for name in item.__slots__)
+            record['pass_rate'] = item.pass_rate
+            self.stream.write(json.dumps(record) + '\n')
+        return True
+
+    def close(self):
+        self.stream.flush()
+        return True
+
+
+class SqliteOutput:
+    # SQLite database of one or more Reports (see SQLITE_TABLES): each Report is inserted in a single executemany()
+    # transaction, and the indexes are built once on close(). Any existing file at path is replaced. sqlite3 is imported
+    # here, only by --format sqlite runs
+    def __init__(self, path):
+        import sqlite3
+        if os.path.exists(path):
+            os.remove(path)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode = MEMORY')    # A fresh output file; nothing to recover if the run fails
+        self.connection.execute('PRAGMA synchronous = OFF')
+        for table in SQLITE_TABLES:
+            self.connection.execute(table)
+        self.reports = 0
+        self.observations = 0   # Observation ids are assigned here so the asset rows can reference them without lastrowid
+
+    def compliance_rows(self, report):
+        # One (test, standard, control) row per mapped control of the requested standards
+        for item in itertools.chain(report.observations, report.statistics):
+            for standard, controls in item.compliance.items():
+                for control in controls.split('\n') if controls else ():
+                    yield item.title, standard, control
+
+    def write(self, report, name):
+        self.reports += 1
+        report_id = self.reports
+        first = self.observations + 1
+        self.observations += len(report.observations)
+        with self.connection:
+            self.connection.execute('INSERT INTO reports VALUES (?, ?, ?)', (report_id, name, report.scan_type))
+            self.connection.executemany('INSERT INTO targets VALUES (?, ?)', [(report_id, target) for target in report.targets])
+            self.connection.executemany('INSERT INTO observations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                (observation_id, report_id, item.domain, item.title, item.severity, item.description, item.remediation, len(item.assets), sum(item.assets.values()))
+                for observation_id, item in enumerate(report.observations, first)))
+            self.connection.executemany('INSERT INTO assets VALUES (?, ?, ?)', (
+                (observation_id, asset, count)
+                for observation_id, item in enumerate(report.observations, first) for asset, count in item.assets.items()))
+            self.connection.executemany('INSERT INTO statistics VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+                (report_id, item.domain, item.title, item.severity, item.passes, item.fails, item.total, item.pass_rate)
+                for item in report.statistics))
+            self.connection.executemany('INSERT OR IGNORE INTO compliance VALUES (?, ?, ?)', self.compliance_rows(report))
+        return True
+
+    def close(self):
+        with self.connection:
+            for index in SQLITE_INDEXES:
+                self.connection.execute(index)
+        self.connection.close()
+        return True
+
+
+def render_jsonl(report, stream, name = 'Observations'):
+    # Write a Report as JSON Lines to a text stream (see JsonlOutput)
+    output = JsonlOutput(stream)
+    output.write(report, name)
+    return output.close()
+
+
+def render_sqlite(report, path, name = 'Observations'):
+    # Write a Report to a new SQLite database at path (see SqliteOutput)
+    output = SqliteOutput(path)
+    output.write(report, name)
+    return output.close()
+
+
+def snapshot_scans(directory):
+    # Path -> (mtime_ns, size) of every scan under directory, for --watch polling
+    snapshot = {}
+    directories = [directory]
+    while directories:
+        try:
+            with os.scandir(directories.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                    elif is_csv(entry.path):
+                        stat = entry.stat()
+                        snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError: # Removed while walking
+            pass
+    return snapshot
+
+
+def load_asyncio():
+    # Bind asyncio at module level on first use, so only --watch runs import it
+    global asyncio
+    if asyncio is None:
+        import asyncio
+    return asyncio
+
+
+class ScanWatcher:
+    # --watch daemon: keeps every scan's groups (see aggregate_groups()) in memory and re-parses only the scans that are
+    # added or changed. Events are debounced per file, parsed by a process pool behind a bounded queue (the debouncer
+    # waits while the pool is WATCH_QUEUE_SIZE files behind), and the merged report is re-rendered once parsing settles
+    def __init__(self, directory, render, options, debounce = 2.0):
+        load_asyncio()
+        self.directory = directory
+        self.render = render        # Called with a Report (in a thread) after every batch of changes
+        self.options = options
+        self.debounce = debounce
+        self.groups = {}            # Scan path -> groups
+        self.pending = {}           # Scan path -> loop time of its latest event
+        self.active = 0             # Scans being parsed right now
+        self.queue = None
+        self.changed = None
+
+    def notice(self, path):
+        self.pending[path] = asyncio.get_running_loop().time()
+
+    def forget(self, path):
+        self.pending.pop(path, None)
+        if self.groups.pop(path, None) is not None:
+            print(f'[+] Removed {path}')
+            self.changed.set()
+
+    async def run(self):
+        self.queue = asyncio.Queue(WATCH_QUEUE_SIZE)
+        self.changed = asyncio.Event()
+        for path in snapshot_scans(self.directory):
+            self.notice(path)
+        print(f'[+] Watching {self.directory} for scans ({len(self.pending)} found) using {"inotify" if inotify_simple else "polling"}')
+        with contextlib.suppress(NotImplementedError):     # Stop cleanly on SIGTERM too, where the platform allows it
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, self.options.jobs)) as executor:
+            tasks = [self.watch_inotify() if inotify_simple else self.watch_polling(), self.dispatch(), self.publish()]
+            tasks += [self.parse(executor) for worker in range(max(1, self.options.jobs))]
+            try:
+                await asyncio.gather(*tasks)
+            except asyncio.CancelledError:
+                print('[=] Stopped watching')
+
+    async def watch_polling(self, interval = 1.0):
+        previous = await asyncio.to_thread(snapshot_scans, self.directory)
+        while True:
+            await asyncio.sleep(interval)
+            current = await asyncio.to_thread(snapshot_scans, self.directory)
+            for path, stat in current.items():
+                if previous.get(path) != stat:
+                    self.notice(path)
+            for path in previous.keys() - current.keys():
+                self.forget(path)
+            previous = current
+
+    async def watch_inotify(self):
+        flags = inotify_simple.flags
+        mask = flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE
+        inotify = inotify_simple.INotify()
+        watches = {}
+        def add_tree(directory):
+            for root, directories, files in os.walk(directory):
+                watches[inotify.add_watch(root, mask)] = root
+                for file in files:  # Written before the watch was in place
+                    if is_csv(os.path.join(root, file)) and directory != self.directory:
+                        self.notice(os.path.join(root, file))
+        add_tree(self.directory)
+
+        ready = asyncio.Event()
+        asyncio.get_running_loop().add_reader(inotify.fileno(), ready.set)
+        while True:
+            await ready.wait()
+            ready.clear()
+            for event in inotify.read(timeout=0):
+                path = os.path.join(watches.get(event.wd, self.directory), event.name)
+                if event.mask & flags.ISDIR:
+                    if event.mask & (flags.CREATE | flags.MOVED_TO):
+                        add_tree(path)
+                    elif event.mask & (flags.DELETE | flags.MOVED_FROM):    # Left the tree: drop its watches and scans
+                        for wd, root in list(watches.items()):
+                            if root == path or root.startswith(path + os.sep):
+                                with contextlib.suppress(OSError):  # Already gone with a deleted folder
+                                    inotify.rm_watch(wd)
+                                del watches[wd]
+                        for scan in [scan for scan in {**self.groups, **self.pending} if scan.startswith(path + os.sep)]:
+                            self.forget(scan)
+                elif is_csv(path):
+                    self.forget(path) if event.mask & (flags.DELETE | flags.MOVED_FROM) else self.notice(path)
+
+    async def dispatch(self):
+        # Queue every scan that has been quiet for the debounce period
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.debounce / 4)
+            for path, seen in list(self.pending.items()):
+                if loop.time() - seen >= self.debounce and self.pending.get(path) == seen:
+                    del self.pending[path]
+                    await self.queue.put(path)  # Backpressure: waits for a free slot
+
+    async def parse(self, executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            path = await self.queue.get()
+            self.active += 1
+            try:
+                groups = await loop.run_in_executor(executor, aggregate_groups, path, self.options)
+            except Exception as error:  # Unreadable or half-written scan; a later event queues it again
+                print(f'[!] Could not parse {path}: {error}')
+            else:
+                if os.path.exists(path):
+                    print(f'[+] Parsed {path}')
+                    self.groups[path] = groups
+                    self.changed.set()
+            finally:
+                self.active -= 1
+                self.queue.task_done()
+
+    async def publish(self):
+        # Re-render once nothing is pending, queued or parsing, or at least every WATCH_RENDER_INTERVAL seconds under load
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.changed.wait()
+            started = loop.time()
+            while (self.pending or not self.queue.empty() or self.active) and loop.time() - started < WATCH_RENDER_INTERVAL:
+                await asyncio.sleep(0.25)
+            self.changed.clear()
+            if self.options.cache_directory:    # Once per batch of changes rather than per parsed scan
+                await asyncio.to_thread(AggregateCache(self.options.cache_directory, self.options.cache_size).evict)
+            target_groups = [(path, self.groups[path]) for path in sorted(self.groups)]
+            report = build_report(target_groups, self.render.standards, self.options.scan_type)
+            try:
+                await asyncio.to_thread(self.render, report)
+            except Exception as error:
+                print(f'[!] Could not write report: {error}')
+
+
+class WatchRenderer:
+    # Writes --watch reports atomically (a temporary file replaced in one step), as a workbook, a JSON summary, JSON Lines or SQLite
+    def __init__(self, output, standards, output_format = 'xlsx', include_statistics = False, static_formats = False, max_assets = None):
+        self.output = output
+        self.standards = standards
+        self.output_format = output_format
+        self.include_statistics = include_statistics
+        self.static_formats = static_formats
+        self.max_assets = max_assets
+
+    def __call__(self, report):
+        temp = f'{self.output}.{os.getpid()}.tmp'
+        if self.output_format == 'json':
+            with open(temp, 'w') as file:
+                render_json(report, file)
+        elif self.output_format == 'jsonl':
+            with open(temp, 'w') as file:
+                render_jsonl(report, file, 'Merged Observations')
+        elif self.output_format == 'sqlite':
+            render_sqlite(report, temp, 'Merged Observations')
         else:
-            standards = args.compliance.split(',')
-            for standard in standards:
-                standard = standard.strip()
-                if standard not in SUPPORTED_COMPLIANCE_STANDARDS:
-                    print(f'[x] Supported standards are: {", ".join(SUPPORTED_COMPLIANCE_STANDARDS)}')
-                    print(f'[x] Compliance standard \'{standard}\' not supported! Exiting!')
-                    exit()
+            render_xlsx(report, temp, self.include_statistics, self.static_formats, sheetname='Merged Observations', max_assets=self.max_assets)
+        os.replace(temp, self.output)
+        print(f'[=] Wrote {len(report.observations)} observations from {len(report.targets)} scans to {self.output}')
+        return True
 
-    worksheet_count = 0
+
+def format_watch(args):
+    try:
+        standards = parse_standards(args.compliance)
+    except ValueError as error:
+        print(f'[x] Supported standards are: {", ".join(SUPPORTED_COMPLIANCE_STANDARDS)}')
+        print(f'[x] {error} Exiting!')
+        return False
+    options = ScanOptions('aquawave' if args.aquawave else 'cli', args.stats_backend, args.jobs, args.cache, args.cache_size*1024*1024, pause_gc=True)
+    render = WatchRenderer(args.output.strip(), standards, args.watch_format, args.include_statistics, args.static_formats, args.max_assets or None)
+    try:
+        load_asyncio().run(ScanWatcher(args.watch, render, options, args.debounce).run())
+    except KeyboardInterrupt:
+        print('[=] Stopped watching')
+    return True
+
+
+def write_profile(profiler, path):
+    with open(path, 'w') as file:
+        json.dump(profiler.close(), file, indent=2)
+    print(f'[+] Wrote stage timings to \'{path}\'')
+
+
+def format_tables(args, targets, standards):
+    # --format jsonl / sqlite: the same aggregation as the workbook tabs (one report per target, or a single merged report
+    # with -m) written straight to tables, without xlsxwriter. Charts, raw output and the other workbook-only tabs are skipped
+    output_path = args.output.strip()
+    if (args.baseline):
+        print(f'[x] --baseline only writes workbooks! Exiting!')
+        return False
+    if (args.format == 'sqlite' and output_path == '-'):
+        print(f'[x] SQLite databases cannot be written to stdout! Exiting!')
+        return False
+    if (args.zip or args.control_pivots):
+        print(f'[!] -z and --control-pivots only apply to workbooks, ignoring')
+
+    options = ScanOptions('aquawave' if args.aquawave else 'cli', args.stats_backend, args.jobs, args.cache if args.target != '-' else None, args.cache_size*1024*1024, pause_gc=True)
+    profiler = Profiler() if args.profile else NULL_PROFILER
+    with profiler.stage('mappings'):
+        load_plugin_index()
+    targets = [target.strip() for target in targets if is_csv(target.strip())]
+    with contextlib.ExitStack() as stack:
+        if (args.format == 'sqlite'):
+            output = SqliteOutput(output_path)
+        else:
+            output = JsonlOutput(sys.__stdout__ if output_path == '-' else stack.enter_context(open(output_path, 'w', encoding='utf-8')))
+        if (args.jobs > 1):
+            print(f'[+] Parsing {len(targets)} targets across {args.jobs} worker processes...')
+        target_groups = iter_target_groups(targets, options, profiler)
+        if (args.merge_targets and not args.target):
+            print(f'[+] Merging observations from {len(targets)} targets into one report')
+            report = build_report(target_groups, standards, options.scan_type, profiler)
+            with profiler.stage('write'):
+                output.write(report, 'Merged Observations')
+        else:
+            for target, groups in target_groups:
+                print(f'[+] Writing observations and pass/fail rates for {target}')
+                report = build_report([(target, groups)], standards, options.scan_type, profiler)
+                with profiler.target(target), profiler.stage('write'):
+                    output.write(report, sheet_name(target))
+        with profiler.stage('close'):
+            output.close()
+
+    if (args.profile):
+        write_profile(profiler, args.profile)
+    print(f'[=] Finished parsing CSVs! Wrote {output.reports} reports to {args.format} output, {output_path}')
+    return True
+
+
+def plan_workbooks(targets, output, include_statistics, max_sheets = 0, raw_output = False):
+    # Split the CSV targets into workbooks of at most max_sheets observations / pass-fail tabs (0 keeps them in one) and
+    # name every tab up front, around the fixed tabs (and the 'Raw Output' tab of -t runs) each workbook will hold. Returns (output path, targets, planned tabs, SheetNames) per workbook; several workbooks
+    # are written next to output as <name>_1.xlsx, <name>_2.xlsx, ...
+    csvs = []
     for target in targets:
-        sheet = target[1+target.rfind(SLASH):target.rfind('.')].capitalize()          # Strip directory path & extension
+        if is_csv(target.strip()):
+            csvs.append(target)
+        else:
+            print(f'[!] {target.strip()} is not a CSV, skipping!')
+    if max_sheets and max_sheets < 1 + include_statistics:
+        raise ValueError(f'{max_sheets} tabs per workbook cannot hold a target\'s observations and pass-fail tabs')
+    per_workbook = max_sheets // (1 + include_statistics) if max_sheets else max(1, len(csvs))
+    chunks = [csvs[start:start+per_workbook] for start in range(0, len(csvs), per_workbook)] or [[]]
+    stem, extension = os.path.splitext(output)
+    plans = []
+    for number, chunk in enumerate(chunks, 1):
+        names = SheetNames(RESERVED_SHEETS + ['Raw Output']*raw_output)
+        path = output if len(chunks) == 1 else f'{stem}_{number}{extension or ".xlsx"}'
+        plans.append((path, chunk, plan_sheets(names, chunk, include_statistics, len(csvs) > 1), names))
+    return plans
+
+
+def format_workbook(args, standards, output_path, targets, sheets = None, names = None):
+    # Write one workbook; target tabs use the names planned by plan_workbooks() (none are planned for merged / trend runs).
+    # Returns the number of worksheets written and the chart data, or None if the run failed
+    # Low memory mode streams every worksheet to disk row by row instead of holding all cells until close()
+    output = WorkbookOutput(output_path, args.zip)
+    workbook = xlsxwriter.Workbook(output.destination, {'constant_memory': args.low_memory})
+    names = names or SheetNames(RESERVED_SHEETS)
+    observation_categories_chart = workbook.add_chartsheet('Observation Categories')
+    risk_levels_chart = workbook.add_chartsheet('Risk Levels')
+    formats = StaticStyles(workbook) if args.static_formats else add_formats(workbook)
+    options = ScanOptions('aquawave' if args.aquawave else 'cli', args.stats_backend, args.jobs, args.cache, args.cache_size*1024*1024, pause_gc=True)
+    max_rows = args.max_rows_per_sheet or EXCEL_MAX_ROWS
+    assets = AssetSheet(workbook, args.max_assets or None, max_rows, names)
+    profiler = Profiler() if args.profile else NULL_PROFILER
+    controls = CompliancePivot(standards) if args.control_pivots else None
+    with profiler.stage('mappings'):
+        load_plugin_index()
+
+    worksheet_count = 0
+    chart_data = [{},{}]    # Observation Areas (index 0), Risk Levels (index 1)
+    chart_sheet = None
+    trend_data = None
+    if (args.baseline):
+        try:
+            written, trend_data = format_targets_trend(workbook, targets, args.baseline, standards, formats, args.include_statistics, options, assets, profiler, controls, names)
+        except (OSError, ValueError) as error:
+            print(f'[x] Could not read baseline: {error} Exiting!')
+            return None
+        worksheet_count += written
+        targets = []
+    elif (args.merge_targets and not args.target):
+        worksheet_count += format_targets_merged(workbook, targets, standards, formats, args.include_statistics, options, chart_data, assets, profiler, controls, names)
+        targets = []
+    elif ((args.jobs > 1 or args.cache) and not args.target):
+        if (args.jobs > 1):
+            print(f'[+] Parsing {len(targets)} targets across {args.jobs} worker processes...')
+        worksheet_count += format_targets_grouped(workbook, targets, standards, formats, args.include_statistics, options, chart_data, assets, profiler, controls, sheets, names)
+        targets = []
+    for target, (sheet, statistics_sheet) in zip(targets, sheets or []):
         print(f'[+] Creating cloud scan workbook for {target.strip()}...')
-        format_observations(workbook, target.strip(), sheet, standards, formats)       # Convert to Excel format
+
+        # Every tab built from this CSV is fed by one pass over the file
+        print(f'[+] Writing observations sheet to \'{sheet}\' tab')
+        sinks = [ObservationsSink(workbook.add_worksheet(sheet), standards, formats, chart_data, args.sorted_input, options.scan_type, assets, controls)]
         worksheet_count += 1
         if (args.include_statistics):
-            format_statistics(workbook, target.strip(), sheet, standards, formats)
+            print(f'[+] Computing pass/fail rates in \'{statistics_sheet}\' tab')
+            sinks.append(new_statistics_sink(workbook.add_worksheet(statistics_sheet), standards, formats, options, args.sorted_input))
             worksheet_count += 1
-    
+        if (args.target):
+            # Reserve the chart data sheet so the raw output tab still lands last
+            print(f'[+] Copying raw Cloudsploit results to \'Raw Output\' tab')
+            chart_sheet = workbook.add_worksheet('ChartData')
+            sinks.append(RawOutputSink(workbook, max_rows, names))
+            worksheet_count += 1
+        with profiler.target(target.strip()):
+            stream_scan(target.strip(), sinks, profiler=profiler, scan_type=options.scan_type, pause_gc=options.pause_gc)
+    with profiler.stage('write'):
+        worksheet_count += assets.close()   # After every target's tabs
+
+    if (controls):
+        with profiler.stage('pivots'):
+            worksheet_count += controls.write(workbook, formats, names)
+
     # Now Compute Charts
-    print(f'[+] Computing charts in \'{args.output}\' for resulting observations...')
-    draw_charts(workbook, observation_categories_chart, risk_levels_chart)
+    print(f'[+] Computing charts in \'{output_path}\' for resulting observations...')
+    with profiler.stage('charts'):
+        if (trend_data):
+            draw_trend_charts(workbook, observation_categories_chart, risk_levels_chart, trend_data)
+        else:
+            draw_charts(workbook, observation_categories_chart, risk_levels_chart, chart_data, chart_sheet)
     print(f'[+] Finished charting observation data!')
     worksheet_count += 3
 
-    if (args.target):
-        print(f'[+] Copying raw Cloudsploit results to \'Raw Output\' tab')
-        copy_raw_output(workbook, args.target)
-        worksheet_count += 1
+    with profiler.stage('close'):
+        workbook.close()
+        output.close()
+    if (args.profile):
+        write_profile(profiler, args.profile)
+    print(f'[!] Note: You\'ll still need to account for \'Unknown\' values, sort observations and statistics tabs and update the ChartData and RiskLevels tabs to have proper numbers / coloring!')
+    print(f'[=] Finished parsing CSVs! Wrote {worksheet_count} worksheets to new workbook, {output_path}')
+    return worksheet_count, chart_data
+
 
+def format_shard(args, standards, plan):
+    # Worker process body of a sharded run: one planned workbook, its targets parsed serially (the workbooks run in parallel)
+    args = argparse.Namespace(**dict(vars(args), jobs=1, profile=None))
+    return format_workbook(args, standards, *plan)
+
+
+def write_index(output, compress, plans, chart_data):
+    # Index workbook of a sharded run: the usual charts over every workbook, and an 'Index' tab linking each target's tabs
+    destination = WorkbookOutput(output, compress)
+    workbook = xlsxwriter.Workbook(destination.destination)
+    observation_categories_chart = workbook.add_chartsheet('Observation Categories')
+    risk_levels_chart = workbook.add_chartsheet('Risk Levels')
+    worksheet = workbook.add_worksheet('Index')
+    worksheet.write_row(0, 0, ['Workbook', 'Observations Tab', 'Pass-Fail Rates Tab', 'Target'])
+    row = 1
+    for path, targets, sheets, names in plans:
+        filename = os.path.basename(path)   # Written next to the index, so links stay valid if the folder is moved
+        for target, tabs in zip(targets, sheets):
+            worksheet.write_url(row, 0, f'external:{filename}', string=filename)
+            for column, sheet in enumerate(tabs, 1):
+                if sheet:
+                    worksheet.write_url(row, column, f'external:{filename}#\'{sheet.replace(chr(39), chr(39)*2)}\'!A1', string=sheet)
+            worksheet.write(row, 3, target.strip())
+            row += 1
+    worksheet.set_column(0, 2, 41)
+    worksheet.set_column(3, 3, 100)
+    worksheet.freeze_panes(1, 0)
+    draw_charts(workbook, observation_categories_chart, risk_levels_chart, chart_data)
     workbook.close()
-    print(f'[!] Note: You\'ll still need to account for \'Unknown\' values, sort observations and statistics tabs and update the ChartData and RiskLevels tabs to have proper numbers / coloring!')
-    print(f'[=] Finished parsing CSVs! Wrote {worksheet_count} worksheets to new workbook, {args.output}')
-    compress_file(args.output) if (args.zip) else exit()
+    return destination.close()
+
+
+def format_sharded(args, standards, plans):
+    # --max-sheets-per-workbook: write every planned workbook, in up to -j worker processes at once, then an index
+    # workbook at the -o path. Worker processes are not profiled; the parent records how long it waited on each workbook
+    output_path = args.output.strip()
+    profiler = Profiler(trace_memory=False) if args.profile else NULL_PROFILER    # Only waits are timed here; tracing would slow serial workbooks
+    print(f'[+] Splitting {sum([len(plan[1]) for plan in plans])} targets across {len(plans)} workbooks...')
+    worksheet_count = 0
+    chart_data = [{},{}]
+    with contextlib.ExitStack() as stack:
+        mapper = map
+        if (args.jobs > 1):
+            mapper = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs, initializer=tracemalloc.stop)).map
+        results = mapper(format_shard, [args]*len(plans), [standards]*len(plans), plans)
+        for plan in plans:
+            with profiler.target(plan[0]), profiler.stage('wait'):
+                result = next(results)
+            if result is None:
+                return False
+            worksheet_count += result[0]
+            for totals, counts in zip(chart_data, result[1]):
+                for key, count in counts.items():
+                    totals[key] = totals.get(key, 0) + count
+
+    print(f'[+] Writing index of {len(plans)} workbooks to \'{output_path}\'')
+    with profiler.stage('index'):
+        write_index(output_path, args.zip, plans, chart_data)
+    if (args.profile):
+        write_profile(profiler, args.profile)
+    print(f'[=] Finished parsing CSVs! Wrote {worksheet_count} worksheets to {len(plans)} workbooks, indexed in {output_path}')
+    return True
+
+
+def format_cloudsploit(args):
+    # Determine scans to include
+    targets = []
+    if (args.target): # individual CSV
+        targets.append(args.target)
+    elif (args.directory):  # Directory specified - get all CSVs recursively
+        targets = get_targets_recursive(args.directory)
+    elif (args.list): # List of CSVs specified in a file
+        targets = get_targets(args.list)
+    else:
+        return print_usage()
+
+    # Determine compliance mappings
+    try:
+        standards = parse_standards(args.compliance)
+    except ValueError as error:
+        print(f'[x] Supported standards are: {", ".join(SUPPORTED_COMPLIANCE_STANDARDS)}')
+        print(f'[x] {error} Exiting!')
+        return False
+    if (args.format != 'xlsx'):
+        return format_tables(args, targets, standards)
+    if (xlsxwriter is None):
+        print(f'[x] Writing workbooks needs the xlsxwriter package! Install it or pick --format jsonl / sqlite. Exiting!')
+        return False
+    if (args.max_sheets_per_workbook < 0 or args.max_rows_per_sheet < 0 or args.max_rows_per_sheet == 1 or args.max_rows_per_sheet > EXCEL_MAX_ROWS):
+        print(f'[x] --max-sheets-per-workbook must be 0 or more and --max-rows-per-sheet between 2 and {EXCEL_MAX_ROWS}! Exiting!')
+        return False
+    if (args.max_sheets_per_workbook and args.max_sheets_per_workbook < 1 + args.include_statistics):
+        print(f'[x] --max-sheets-per-workbook must be at least 2 with --include-statistics, to hold a target\'s observations and pass-fail tabs! Exiting!')
+        return False
+    if (args.low_memory and not args.sorted_input):
+        print(f'[!] --low-memory only streams the worksheets; without --sorted-input each scan is still grouped in memory before it is written')
+
+    # Merged and trend runs write a fixed set of tabs; otherwise every target's tabs are named (and split) up front
+    output_path = args.output.strip()
+    if (args.baseline or (args.merge_targets and not args.target)):
+        plans = [(output_path, targets, None, None)]
+    else:
+        plans = plan_workbooks(targets, output_path, args.include_statistics, args.max_sheets_per_workbook, bool(args.target))
+    if (len(plans) > 1 and output_path == '-'):
+        print(f'[x] Split workbooks cannot be written to stdout! Exiting!')
+        return False
+    if (len(plans) > 1):
+        return format_sharded(args, standards, plans)
+    return format_workbook(args, standards, *plans[0]) is not None
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser('python3 format_cloudsploit.py -d C:\Path\To\Directory -o PreliminaryObservations.xlsx')
     parser.add_argument('-l', '--list', help='File containing a list of input CSVs, one per line', required=False)
-    parser.add_argument('-t', '--target', help='Target input CSV file', required=False)
-    parser.add_argument('-d', '--directory', help='Target folder. FormatCloudsploit will recursively search for all CSV files and merge them into one Excel workbook', required=False)
-    parser.add_argument('-z', '--zip', help='Create a compressed zip file as well the original (default: False)', default=False, action='store_true', required=False)
-    parser.add_argument('-o', '--output', help='Filename to write to (default: \'observations.xlsx\')', default='observations.xlsx', required=False)
+    parser.add_argument('-t', '--target', help='Target input CSV file (optionally .gz / .zip compressed); \'-\' reads from stdin', required=False)
+    parser.add_argument('-d', '--directory', help='Target folder. FormatCloudsploit will recursively search for all CSV files (.csv, .csv.gz and .zip) and merge them into one Excel workbook', required=False)
+    parser.add_argument('-z', '--zip', help='Create a compressed zip file as well the original; with \'-o -\' only the zip is written (default: False)', default=False, action='store_true', required=False)
+    parser.add_argument('-o', '--output', help='Filename to write to; \'-\' writes to stdout (default: \'observations.xlsx\')', default='observations.xlsx', required=False)
+    parser.add_argument('-f', '--format', choices=list(OUTPUT_FORMATS), default='xlsx', help='Output format; \'jsonl\' and \'sqlite\' write the observations, pass-fail rates, affected assets and compliance mappings as tables, skipping the workbook (default: xlsx)')
     parser.add_argument('-c', '--compliance', help='Compliance standard to map results (default: ALL)', default="ALL", required=False)
-    parser.add_argument('-a', '--aquawave', action='store_true', default=False, help='Indicates CSV results from Aquawave rather than CLI (default: False)')
-    parser.add_argument('--include-statistics', action='store_true', default=False, help='Include pass-fail rates in a seperate tab (default: False)')
+    parser.add_argument('-a', '--aquawave', action='store_true', default=False, help='Read CSVs whose layout cannot be told from their header or results as Aquawave rather than CLI results, with a warning; the layout is otherwise detected (default: False)')
+    parser.add_argument('--compile-mappings', action='store_true', default=False, help='Rebuild the compiled plugin mapping index from static/plugin_mappings.json and exit')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes used to parse targets from -d / -l; workers return grouped results and the main process writes every tab (default: 1)')
+    parser.add_argument('--cache', help='Directory for cached per-CSV aggregates; unchanged CSVs from -d / -l are not parsed again (default: disabled)', default=None, required=False)
+    parser.add_argument('--cache-size', type=int, default=512, help='Size limit of the --cache directory in MB; least recently used entries are evicted (default: 512)')
+    parser.add_argument('-m', '--merge-targets', action='store_true', default=False, help='Merge every target from -d / -l into a single observations tab, one row per test (default: False)')
+    parser.add_argument('--sorted-input', action='store_true', default=False, help='Trust that each CSV is sorted by test title and write each test as soon as it ends instead of grouping the whole file (default: False)')
+    parser.add_argument('--low-memory', action='store_true', default=False, help='Write worksheets row by row in constant memory; each scan is still grouped in memory unless --sorted-input is also given (default: False)')
+    parser.add_argument('--stats-backend', choices=STATISTICS_BACKENDS, default='loop', help='How pass-fail rates are counted; \'columnar\' dictionary-encodes results into compact arrays and counts them in bulk with NumPy. Without NumPy it falls back to collections.Counter and is slower than \'loop\' (default: loop)')
+    parser.add_argument('--static-formats', action='store_true', default=False, help='Write each cell with its final format instead of adding conditional formatting rules to every sheet (default: False)')
+    parser.add_argument('--max-assets', type=int, default=0, help='Most affected assets listed in an observation\'s cell; the rest go to an \'Assets\' tab (default: 0, only limited by Excel\'s cell length)')
+    parser.add_argument('--control-pivots', action='store_true', default=False, help='Add a tab per selected compliance standard listing its failing controls with failing test / asset counts and worst severity (default: False)')
+    parser.add_argument('-w', '--watch', help='Watch a folder and keep a merged workbook of every scan in it up to date as scans are added, changed or removed (default: disabled)', default=None, required=False)
+    parser.add_argument('--watch-format', choices=['xlsx', 'json'] + list(OUTPUT_FORMATS)[1:], default='xlsx', help='What --watch keeps up to date at the output path: the workbook, a JSON summary, or JSON Lines / SQLite tables as with --format (default: xlsx)')
+    parser.add_argument('--debounce', type=float, default=2.0, help='Seconds a scan must stay unchanged before --watch parses it (default: 2)')
+    parser.add_argument('--baseline', help='Earlier scan CSV (or --cache entry) to compare against; writes New, Resolved and Persisting tabs instead of one tab per target (default: disabled)', default=None, required=False)
+    parser.add_argument('--max-sheets-per-workbook', type=int, default=0, help='Split the observations / pass-fail tabs of -d / -l targets across workbooks of at most this many tabs, written in parallel with -j, plus an index workbook at the output path (default: 0, a single workbook)')
+    parser.add_argument('--max-rows-per-sheet', type=int, default=0, help=f'Continue the Raw Output and Assets tabs on a new tab past this many rows (default: 0, Excel\'s limit of {EXCEL_MAX_ROWS})')
+    parser.add_argument('--profile', help='Write per-target stage timings, row counts and tracemalloc peaks to this JSON file (default: disabled)', default=None, required=False)
+    parser.add_argument('--cprofile', help='Also dump cProfile statistics for the whole run to this file, for pstats / snakeviz (default: disabled)', default=None, required=False)
+    parser.add_argument('--include-statistics', action='store_true', default=False, help='Include pass-fail rates in a seperate tab, \'Pass-Fail Rates\' for a single target, otherwise named after each target\'s observations tab (\'<tab> Rates\') (default: False)')
     args = parser.parse_args()
+    output_format = args.watch_format if args.watch else args.format
+    if (output_format != 'xlsx' and args.output == parser.get_default('output')):
+        args.output = 'observations' + OUTPUT_FORMATS.get(output_format, '.json')
 
-    if (args.aquawave):
-        SCAN_TYPE = 'aquawave'
+    if (args.max_assets < 0):
+        print(f'[x] --max-assets must be 0 (no cap) or more! Exiting!')
+        exit(1)
+    if (args.output.strip() == '-'):
+        sys.stdout = sys.stderr     # Keep progress messages out of the workbook written to stdout
 
-    if (not any([args.target, args.list, args.directory])):
+    if (args.compile_mappings):
+        print(f'[=] Compiled {len(load_plugin_index(rebuild=True))} plugin mappings to \'{MAPPINGS_INDEX}\'')
+    elif (args.watch):
+        format_watch(args)
+    elif (not any([args.target, args.list, args.directory])):
         print_usage()
-    else:
-        format_cloudsploit(args)
+    elif (args.cprofile):
+        profile = cProfile.Profile()
+        succeeded = profile.runcall(format_cloudsploit, args)
+        profile.dump_stats(args.cprofile)
+        print(f'[+] Wrote cProfile statistics to \'{args.cprofile}\'')
+        if (not succeeded):
+            exit(1)
+    elif (not format_cloudsploit(args)):
+        exit(1)
 
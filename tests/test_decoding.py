@@ -0,0 +1,119 @@
+import csv
+import io
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import format_cloudsploit
+
+
+HEADER = ['category', 'title', 'description', 'resource', 'region', 'statusWord', 'message']
+COLUMNS = format_cloudsploit.get_columns('cli')
+
+
+def expected_columns(data):
+    # What the csv module reads from the same bytes, projected to the (title, asset, region, result) columns
+    rows = list(filter(None, csv.reader(io.TextIOWrapper(io.BytesIO(data), format_cloudsploit.SCAN_ENCODING))))[1:]
+    return [[row[column] for row in rows] for column in COLUMNS]
+
+
+def read_columns(data, width = len(HEADER), columns = COLUMNS):
+    # read_columns() over a scan's bytes, its batches joined into whole columns
+    file = io.BufferedReader(io.BytesIO(data))
+    file.readline()
+    decoded = [[], [], [], []]
+    for batch in format_cloudsploit.read_columns(file, width, columns):
+        for column, values in zip(decoded, batch):
+            column.extend(values)
+    return decoded
+
+
+def export(rows, lineterminator = '\n'):
+    text = io.StringIO()
+    writer = csv.writer(text, lineterminator = lineterminator)
+    writer.writerow(HEADER)
+    writer.writerows(rows)
+    return text.getvalue()
+
+
+def row(index, message = 'All good', description = 'Checks things'):
+    return ['EC2', f'Test {index % 5}', description, f'arn:aws:ec2:i-{index}', 'us-east-1', ['OK', 'FAIL', 'WARN'][index % 3], message]
+
+
+class ReadColumnsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.read_chunk = format_cloudsploit.READ_CHUNK
+
+    def tearDown(self):
+        format_cloudsploit.READ_CHUNK = self.read_chunk
+
+    def assertMatchesCsv(self, text, width = len(HEADER)):
+        data = text.encode(format_cloudsploit.SCAN_ENCODING)
+        for read_chunk in [1, 3, 7, 16, 64, 4096, self.read_chunk]:    # Small chunks are cut between records by quote parity
+            format_cloudsploit.READ_CHUNK = read_chunk
+            with self.subTest(read_chunk = read_chunk):
+                self.assertEqual(read_columns(data, width), expected_columns(data))
+
+    def test_unquoted(self):
+        self.assertMatchesCsv(export([row(index) for index in range(50)]))
+
+    def test_quoted_commas(self):
+        self.assertMatchesCsv(export([row(index, message = 'Found 3 open ports: 22, 80, 443') for index in range(50)]))
+
+    def test_quotes_inside_fields(self):
+        self.assertMatchesCsv(export([row(index, message = 'Bucket "logs" is public', description = '"Quoted", then more') for index in range(50)]))
+
+    def test_multi_line_fields(self):
+        self.assertMatchesCsv(export([row(index, message = 'First line\nsecond, line\r\nthird "line"') for index in range(50)]))
+
+    def test_quoted_key_columns(self):
+        rows = [row(index) for index in range(50)]
+        rows[7][1] = 'Test, with comma'
+        rows[9][3] = 'arn:aws:s3:::"bucket"\nname'
+        self.assertMatchesCsv(export(rows))
+
+    def test_crlf(self):
+        self.assertMatchesCsv(export([row(index, message = 'a, b' if index % 2 else 'a') for index in range(50)], lineterminator = '\r\n'))
+
+    def test_blank_lines(self):
+        lines = export([row(index) for index in range(50)]).split('\n')
+        lines[10:10] = ['', '']
+        self.assertMatchesCsv('\n'.join(lines) + '\n')
+
+    def test_ragged_rows(self):
+        rows = [row(index) for index in range(50)]
+        rows[5].append('extra')
+        rows[20].append('extra, quoted')
+        self.assertMatchesCsv(export(rows))
+
+    def test_no_trailing_newline(self):
+        self.assertMatchesCsv(export([row(index, message = 'x, y') for index in range(50)]).rstrip('\n'))
+
+    def test_stray_quotes(self):
+        rows = [row(index) for index in range(50)]
+        text = export(rows).replace('All good', 'All 5" good', 1)    # A quote inside an unquoted field, as csv reads it
+        self.assertMatchesCsv(text)
+
+    def test_stray_quote_before_multi_line_field(self):
+        rows = [row(index, message = 'First line\nsecond, line' if index in (20, 35) else 'All good') for index in range(50)]
+        text = export(rows).replace('All good', 'All 5" good', 1)    # Flips the quote parity chunks are cut by
+        self.assertMatchesCsv(text)
+
+    def test_random_exports(self):
+        rng = random.Random(19)
+        values = ['plain', 'has, comma', 'multi\nline', 'quote "q" here', '', ' spaced ', '"', ',', '\r\n']
+        for case in range(200):
+            rows = [[rng.choice(values) for column in HEADER] for index in range(rng.randint(0, 30))]
+            text = export(rows, lineterminator = rng.choice(['\n', '\r\n']))
+            if rows and rng.random() < 0.3:
+                text = text.rstrip('\r\n')
+            with self.subTest(case = case):
+                self.assertMatchesCsv(text)
+
+
+if __name__ == '__main__':
+    unittest.main()